@@ -136,6 +136,39 @@ check_file_log_contains_only_read() {
   test "${r_events} -gt 0 -a ${r_events} = ${nb_events}"
 }
 
+# start_analysis_worker <directory>
+# start a worker executing io_profile.py and calibration.py command lines
+# (see tests/analysis_worker.py), requests are sent through FIFOs created
+# in directory and file descriptors 7 and 8
+start_analysis_worker() {
+  rm -f "$1/worker_request" "$1/worker_response"
+  mkfifo "$1/worker_request" "$1/worker_response"
+  python3 "${IOTRACER_PATH}/tests/analysis_worker.py" serve \
+    < "$1/worker_request" > "$1/worker_response" &
+  exec 7> "$1/worker_request"
+  exec 8< "$1/worker_response"
+  rm -f "$1/worker_request" "$1/worker_response"
+}
+
+# analysis_request <io_profile|calibration> <arguments>...
+# execute a command line in the analysis worker, print its output and
+# return its exit status (arguments must not contain spaces)
+analysis_request() {
+  local status length
+  echo "$*" >&7
+  read status length <&8
+  if [ "${length}" -gt 0 ]; then
+    head -c "${length}" <&8
+  fi
+  return "${status}"
+}
+
+# stop_analysis_worker
+stop_analysis_worker() {
+  exec 7>&-
+  exec 8<&-
+}
+
 if [ "${script_sourced}" = "false" -a $# -ge 1 ]; then
   eval "$@"
 fi
@@ -25,8 +25,6 @@ fdate() {
 
 IOTRACER_PATH=$(readlink -e "$(dirname "$0")/..")
 
-io_profile="${IOTRACER_PATH}"/tests/io_profile.py
-
 # function clear_cache
 . "${IOTRACER_PATH}"/scripts/cache_func.sh
  
@@ -106,6 +104,10 @@ copy_from_guest() {
 # Load iotracer module
 load_iotracer
 
+# Start worker analysing logs
+worker_dir=$(mktemp -d)
+start_analysis_worker "${worker_dir}"
+
 # Install workload script in guest
 copy_on_guest "${IOTRACER_PATH}"/scripts/workload.sh "/home/${user}/"
 
@@ -140,12 +142,16 @@ for pattern in write read rw randwrite randread randrw; do
         if [ "${blktrace_log}" = "on" ]; then
             sudo killall -s 2 blktrace
         fi
-        "${io_profile}" log "${pattern}/log/exec_${i}".log >> "${pattern}/exec_${i}".log
+        analysis_request io_profile log "${pattern}/log/exec_${i}".log >> "${pattern}/exec_${i}".log
     done;
     exec_on_guest "rm ${pattern}.*"
 done
 
 exec_on_guest rm workload.sh
 
+# Stop worker analysing logs
+stop_analysis_worker
+rmdir "${worker_dir}"
+
 # Unload iotracer module
 unload_iotracer
@@ -0,0 +1,158 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import os
+import shlex
+import socket
+import sys
+
+
+"""
+    Persistent worker executing io_profile.py and calibration.py command
+    lines in a warm process, so that analysing a log does not pay for
+    interpreter startup and imports
+    Protocol (on a Unix socket or on stdin/stdout): a request is one line
+    "<tool> <arguments>" where tool is io_profile or calibration and
+    arguments are shell-quoted; the response is a line "<status> <length>"
+    followed by length bytes of output (stdout and stderr of the command)
+    Requests are executed one at a time
+"""
+
+_tools = ['io_profile', 'calibration']
+
+
+class AnalysisWorker:
+    def __init__(self):
+        self._parsers = {}
+        for tool in _tools:
+            self._parsers[tool] = __import__(tool).build_parser()
+            self._parsers[tool].prog = tool
+        # load heavy modules now rather than at first request
+        import numpy
+        import calibration_db
+        numpy.zeros(1)
+        calibration_db.CalibrationDatabase
+    
+    # Execute a request line, return (exit status, output bytes)
+    def execute(self, request):
+        import contextlib
+        import io
+        
+        output = io.StringIO()
+        status = 0
+        with contextlib.redirect_stdout(output), \
+                contextlib.redirect_stderr(output):
+            try:
+                argv = shlex.split(request)
+                if not argv or argv[0] not in self._parsers:
+                    raise ValueError('unknown tool, expected one of %s'
+                                     % ', '.join(_tools))
+                parser = self._parsers[argv[0]]
+                args = parser.parse_args(argv[1:])
+                if hasattr(args, 'func'):
+                    args.func(args)
+                else:
+                    parser.print_usage()
+            except SystemExit as e:
+                if isinstance(e.code, int):
+                    status = e.code
+                elif e.code is not None:
+                    print(e.code)
+                    status = 1
+            except Exception as e:
+                print('%s: %s' % (type(e).__name__, e))
+                status = 1
+        return (status, output.getvalue().encode())
+    
+    def _serve_stream(self, rfile, wfile):
+        for line in rfile:
+            (status, output) = self.execute(line.decode().rstrip('\n'))
+            wfile.write(b'%d %d\n' % (status, len(output)))
+            wfile.write(output)
+            wfile.flush()
+    
+    def serve_stdin(self):
+        self._serve_stream(sys.stdin.buffer, sys.stdout.buffer)
+    
+    # Serve requests of clients connected to a Unix socket until killed
+    def serve_socket(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(16)
+        try:
+            while True:
+                (connection, address) = server.accept()
+                with connection, connection.makefile('rb') as rfile, \
+                        connection.makefile('wb') as wfile:
+                    self._serve_stream(rfile, wfile)
+        finally:
+            server.close()
+            os.unlink(path)
+
+
+# Send a request to a worker listening on a Unix socket
+# Return (exit status, output bytes)
+def request(path, argv):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        with connection.makefile('rwb') as stream:
+            stream.write(' '.join(shlex.quote(a) for a in argv).encode() +
+                         b'\n')
+            stream.flush()
+            (status, length) = stream.readline().split()
+            return (int(status), stream.read(int(length)))
+
+
+if __name__ == "__main__":
+    # create the top-level parser
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    
+    # create the parser for the "serve" command
+    parser_serve = subparsers.add_parser(
+        'serve',
+        help='serve requests on a Unix socket (or on stdin/stdout)')
+    parser_serve.add_argument('--socket',
+                              help='path of Unix socket (default: serve'
+                                   ' requests read on stdin)')
+    parser_serve.set_defaults(command='serve')
+    
+    # create the parser for the "request" command
+    parser_request = subparsers.add_parser(
+        'request',
+        help='execute a command line in a worker')
+    parser_request.add_argument('socket', help='path of Unix socket')
+    parser_request.add_argument('tool', choices=_tools)
+    parser_request.add_argument('arguments', nargs=argparse.REMAINDER)
+    parser_request.set_defaults(command='request')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    if getattr(args, 'command', None) == 'serve':
+        worker = AnalysisWorker()
+        if args.socket:
+            worker.serve_socket(args.socket)
+        else:
+            worker.serve_stdin()
+    elif getattr(args, 'command', None) == 'request':
+        (status, output) = request(args.socket,
+                                   [args.tool] + args.arguments)
+        sys.stdout.buffer.write(output)
+        sys.exit(status)
+    else:
+        parser.print_usage()
@@ -0,0 +1,88 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import sys
+
+from benchmarks import hot_paths
+from benchmarks import runner
+
+
+def run_benchmarks(args):
+    names = args.benchmark or list(hot_paths.benchmarks)
+    results = []
+    print("benchmark\tsize\tevents\tseconds\tevents/s\tpeak_rss_kb")
+    for size in args.sizes:
+        logpath = runner.synthetic_log(args.directory, size)
+        for name in names:
+            result = runner.run_benchmark(name, logpath, size)
+            results.append(result)
+            print("%s\t%s\t%s\t%.3f\t%.0f\t%s" % result)
+    runner.BenchmarkHistory(args.history).add(results)
+
+
+def compare_benchmarks(args):
+    history = runner.BenchmarkHistory(args.history)
+    nb_regressions = 0
+    print("benchmark\tsize\tevents/s\treference\tchange\tstatus")
+    for (name, size, events_per_s, reference, change,
+         regression) in history.compare(threshold=args.threshold):
+        if regression:
+            nb_regressions += 1
+        print("%s\t%s\t%.0f\t%.0f\t%.1f%%\t%s" % (
+            name, size, events_per_s, reference, change,
+            "REGRESSION" if regression else "ok"))
+    if nb_regressions > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # create the top-level parser
+    parser = argparse.ArgumentParser(prog='benchmarks')
+    parser.add_argument('--history', default='benchmarks.json',
+                        help='JSON history file (default: %(default)s)')
+    subparsers = parser.add_subparsers()
+    
+    # create the parser for the "run" command
+    parser_run = subparsers.add_parser('run', help='run benchmarks')
+    parser_run.add_argument('--sizes', type=lambda s: int(float(s)),
+                            nargs='+', default=[100000, 1000000],
+                            help='numbers of VFS events of synthetic logs,'
+                                 ' from 1e5 to 1e8 (default: 1e5 1e6)')
+    parser_run.add_argument('--benchmark', action='append',
+                            choices=list(hot_paths.benchmarks),
+                            help='benchmark to run (default: all)')
+    parser_run.add_argument('--directory', default='/tmp/iotracer_benchmarks',
+                            help='directory of synthetic logs'
+                                 ' (default: %(default)s)')
+    parser_run.set_defaults(func=run_benchmarks)
+    
+    # create the parser for the "compare" command
+    parser_compare = subparsers.add_parser(
+        'compare',
+        help='compare last run with previous runs')
+    parser_compare.add_argument('--threshold', type=float, default=10.0,
+                                help='events/s decrease in percentage'
+                                     ' flagged as regression'
+                                     ' (default: %(default)s)')
+    parser_compare.set_defaults(func=compare_benchmarks)
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    if len(vars(args)) > 1:
+        # do the work
+        args.func(args)
+    else:
+        parser.print_usage()
@@ -0,0 +1,92 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import contextlib
+import os
+
+from collections import OrderedDict
+
+import iotracer
+import io_profile
+import calibration
+import vfs_block_info
+
+
+"""
+    Benchmarks of trace analysis hot paths
+    Each benchmark gets the path of a synthetic log of nb_events VFS events
+    (each followed by its BLK event) and returns the number of events it
+    processed
+"""
+
+
+def iterate_events(logpath, nb_events):
+    count = 0
+    for event in iotracer.IoTracerLog(logpath):
+        count += 1
+    return count
+
+
+def profiler_stats(logpath, nb_events):
+    profiler = io_profile.IoProfiler(iotracer.IoTracerLog(logpath))
+    return profiler.stats(iotracer.IoLevel.VFS).events
+
+
+# nb_events values stored as runs of _calibration_metrics metrics
+_calibration_metrics = 100
+
+
+def calibration_data(logpath, nb_events):
+    data = calibration.CalibrationData()
+    names = ['metric%s' % i for i in range(_calibration_metrics)]
+    nb_runs = max(nb_events // _calibration_metrics, 1)
+    for run in range(nb_runs):
+        data.update_from_dict(iotracer.IoLevel.VFS,
+                              OrderedDict((name, run) for name in names))
+    str(data)
+    return nb_runs * _calibration_metrics
+
+
+# Extents of a fragmented file: extents of 8 blocks spread on the device
+class _FragmentedFile(vfs_block_info.FileExtentsListPrototype):
+    def __init__(self, file_size, block_size=4096, extent_blocks=8):
+        super().__init__()
+        self._filepath = 'fragmented'
+        self._block_size = block_size
+        self._nb_blocks = -(-file_size // block_size)
+        self._filesize = file_size
+        self._extent_tab = [
+            vfs_block_info.file_extent(block, 2 * block + 1000, extent_blocks)
+            for block in range(0, self._nb_blocks, extent_blocks)]
+
+
+def vfs_to_block(logpath, nb_events):
+    file_extents = vfs_block_info.FileExtentsList(
+        _FragmentedFile(benchmark_file_size))
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            vfs_block_info.vfs_to_block(iotracer.IoTracerLog(logpath),
+                                        file_extents, False)
+    return 2 * nb_events
+
+
+# size of the file accessed by synthetic logs
+benchmark_file_size = 1 << 30
+
+benchmarks = OrderedDict([
+    ('iterate_events', iterate_events),
+    ('profiler_stats', profiler_stats),
+    ('calibration_data', calibration_data),
+    ('vfs_to_block', vfs_to_block),
+])
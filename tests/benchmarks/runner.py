@@ -0,0 +1,133 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import time
+
+from collections import namedtuple
+
+import trace_generator
+
+from benchmarks import hot_paths
+
+benchmark_result = namedtuple('benchmark_result',
+                              'name size events seconds events_per_s '
+                              'peak_rss_kb')
+
+
+# Path of the synthetic log of nb_events VFS events, created if needed
+def synthetic_log(directory, nb_events, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'synthetic_%s_%s.log' % (nb_events, seed))
+    if not os.path.exists(path):
+        generator = trace_generator.TraceGenerator(
+            file_size=hot_paths.benchmark_file_size, seq_ratio=0.5,
+            read_ratio=0.5, sizes=(4096, 65536), size_weights=(3, 1),
+            nb_processes=4, blk_sector=2048, seed=seed)
+        with open(path + '.tmp', 'wb') as output:
+            generator.write(nb_events, output,
+                            nb_jobs=multiprocessing.cpu_count())
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def _run_benchmark(name, logpath, nb_events, results):
+    start = time.perf_counter()
+    events = hot_paths.benchmarks[name](logpath, nb_events)
+    seconds = time.perf_counter() - start
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((events, seconds, peak_rss_kb))
+
+
+# Run a benchmark in a new process, so that its peak RSS is not disturbed
+# by other benchmarks
+# Raise RuntimeError if the process dies without a result
+def run_benchmark(name, logpath, nb_events, poll_interval=1.0):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_benchmark,
+                              args=(name, logpath, nb_events, results))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=poll_interval)
+        except queue.Empty:
+            if not process.is_alive():
+                # the result may have been put just before exiting
+                try:
+                    result = results.get(timeout=poll_interval)
+                except queue.Empty:
+                    process.join()
+                    raise RuntimeError(
+                        'benchmark %s died with exit code %s' % (
+                            name, process.exitcode))
+    process.join()
+    (events, seconds, peak_rss_kb) = result
+    return benchmark_result(name, nb_events, events, seconds,
+                            events / seconds if seconds > 0 else 0.0,
+                            peak_rss_kb)
+
+
+"""
+    History of benchmark runs stored in a JSON file
+    Each run is a dict with date, host, python version and list of results
+"""
+
+
+class BenchmarkHistory:
+    def __init__(self, path):
+        self._path = path
+        self.runs = []
+        if os.path.exists(path):
+            with open(path, 'r') as history_file:
+                self.runs = json.load(history_file)
+    
+    def add(self, results):
+        self.runs.append({'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'host': platform.node(),
+                          'python': platform.python_version(),
+                          'results': [r._asdict() for r in results]})
+        with open(self._path + '.tmp', 'w') as history_file:
+            json.dump(self.runs, history_file, indent=1)
+        os.rename(self._path + '.tmp', self._path)
+    
+    # Compare results of run number index with mean of previous runs
+    # Return list of (name, size, events/s, reference events/s, change,
+    # regression) tuples, regression is True when events/s decreased by
+    # more than threshold percent
+    def compare(self, index=-1, threshold=10.0, nb_references=5):
+        if not self.runs:
+            return []
+        index %= len(self.runs)
+        references = self.runs[max(index - nb_references, 0):index]
+        comparison = []
+        for result in self.runs[index]['results']:
+            key = (result['name'], result['size'])
+            previous = [r['events_per_s'] for run in references
+                        for r in run['results']
+                        if (r['name'], r['size']) == key]
+            if not previous:
+                continue
+            reference = sum(previous) / len(previous)
+            change = 100 * (result['events_per_s'] - reference) / reference
+            comparison.append((result['name'], result['size'],
+                               result['events_per_s'], reference, change,
+                               change < -threshold))
+        return comparison
@@ -0,0 +1,108 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+
+import numpy
+import iotracer
+import iotracer_arrays
+import vfs_block_info
+
+
+"""
+    Attribution of BLK traffic of a device to the files stored on it
+    Bytes and events are counted for each file, by access type. Traffic
+    on blocks not belonging to any of the files is counted as unattributed.
+"""
+
+
+class BlkAttribution:
+    def __init__(self, index):
+        self._index = index
+        nb_files = len(index.files) + 1
+        self.read_bytes = numpy.zeros(nb_files, dtype=numpy.int64)
+        self.write_bytes = numpy.zeros(nb_files, dtype=numpy.int64)
+        self.read_events = numpy.zeros(nb_files, dtype=numpy.int64)
+        self.write_events = numpy.zeros(nb_files, dtype=numpy.int64)
+    
+    # Account a chunk of BLK events (IoEventArrays)
+    # Return file index and logical offset of each event
+    def update(self, blk):
+        (file_index, offset) = self._index.files_from_sectors(blk.address)
+        # unattributed events are counted in last slot
+        slot = numpy.where(file_index >= 0, file_index,
+                           len(self._index.files))
+        nb_files = len(self.read_bytes)
+        for write, nbytes, nevents in [
+                (False, self.read_bytes, self.read_events),
+                (True, self.write_bytes, self.write_events)]:
+            mask = blk.write == write
+            nbytes += numpy.bincount(slot[mask], weights=blk.size[mask],
+                                     minlength=nb_files).astype(numpy.int64)
+            nevents += numpy.bincount(slot[mask], minlength=nb_files)
+        return file_index, offset
+    
+    def __str__(self):
+        names = [f.filepath for f in self._index.files] + ['(unattributed)']
+        lines = ["file\tread_bytes\tread_events\twrite_bytes\twrite_events"]
+        for i in numpy.argsort(-(self.read_bytes + self.write_bytes),
+                               kind='stable'):
+            if self.read_events[i] + self.write_events[i] > 0:
+                lines.append("\t".join([names[i],
+                                        "%s" % self.read_bytes[i],
+                                        "%s" % self.read_events[i],
+                                        "%s" % self.write_bytes[i],
+                                        "%s" % self.write_events[i]]))
+        return "\n".join(lines)
+
+
+def attribute_log(iotracer_log, index, print_events=False):
+    attribution = BlkAttribution(index)
+    for blk in iotracer_arrays.iter_event_arrays(iotracer_log,
+                                                 iotracer.IoLevel.BLK):
+        (file_index, offset) = attribution.update(blk)
+        if print_events:
+            for i in range(len(blk)):
+                filepath = (index.files[file_index[i]].filepath
+                            if file_index[i] >= 0 else None)
+                print("%.9f:%s:%s:%s:BLK -> %s:%s" % (
+                    blk.time[i], 'W' if blk.write[i] else 'R',
+                    blk.address[i], blk.size[i], filepath, offset[i]))
+    return attribution
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iotracerlog', help='file containing iotracer log')
+    parser.add_argument('filefrag', nargs='+',
+                        help='files containing output of command filefrag -v'
+                             ' for files stored on the traced device'
+                             ' (files themselves with --fiemap)')
+    parser.add_argument('--fiemap', action='store_true',
+                        help='read extents of the files with FIEMAP ioctl')
+    parser.add_argument('--events', action='store_true',
+                        help='display attribution of each BLK event')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    if args.fiemap:
+        prototype = vfs_block_info.FiemapExtentsReader
+    else:
+        prototype = vfs_block_info.FilefragOutputParser
+    index = vfs_block_info.PhysicalExtentsIndex(
+        [vfs_block_info.FileExtentsList(prototype(f)) for f in args.filefrag])
+    print(attribute_log(iotracer.IoTracerLog(args.iotracerlog), index,
+                        args.events))
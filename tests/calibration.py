@@ -15,16 +15,132 @@
 import argparse
 import sys
 import re
+import warnings
 
 from pathlib import Path
 from collections import defaultdict
 from collections import OrderedDict
 
-import numpy
+import instrumentation
 import iotracer
-import io_profile
+import lazy_import
 import linux_utils
 
+# heavy modules are only loaded when used
+numpy = lazy_import.lazy_import('numpy')
+calibration_db = lazy_import.lazy_import('calibration_db')
+io_profile = lazy_import.lazy_import('io_profile')
+
+
+"""
+    Growable columnar storage of calibration runs for one level
+    Each metric is a row of a 2-D array whose columns are the runs, capacity
+    is doubled when full so that appending a run is amortised O(1)
+"""
+
+
+class CalibrationColumns:
+    _initial_capacity = 64
+    
+    def __init__(self, names=(), capacity=None):
+        self._names = []
+        self._index = {}
+        self._integer = []
+        self._size = 0
+        self._data = numpy.empty((0, capacity or self._initial_capacity),
+                                 dtype=numpy.float64)
+        for name in names:
+            self._add_column(name)
+    
+    def __len__(self):
+        return self._size
+    
+    def names(self):
+        return list(self._names)
+    
+    def _add_column(self, name, integer=True):
+        # runs done before this metric appeared have no value for it
+        row = numpy.full((1, self._data.shape[1]), numpy.nan)
+        self._data = numpy.concatenate((self._data, row))
+        self._index[name] = len(self._names)
+        self._names.append(name)
+        self._integer.append(integer)
+    
+    def _reserve(self, nb_runs):
+        capacity = self._data.shape[1]
+        if self._size + nb_runs > capacity:
+            while self._size + nb_runs > capacity:
+                capacity *= 2
+            data = numpy.full((self._data.shape[0], capacity), numpy.nan)
+            data[:, :self._size] = self._data[:, :self._size]
+            self._data = data
+    
+    def append(self, values):
+        self.extend({name: (value,) for name, value in values.items()})
+    
+    def extend(self, columns):
+        nb_runs = max([len(v) for v in columns.values()] + [0])
+        if nb_runs > 0:
+            for name in columns:
+                if name not in self._index:
+                    self._add_column(name)
+            self._reserve(nb_runs)
+            new_runs = slice(self._size, self._size + nb_runs)
+            self._data[:, new_runs] = numpy.nan
+            for name, values in columns.items():
+                values = numpy.asarray(values)
+                row = self._index[name]
+                if values.dtype.kind not in 'iub':
+                    self._integer[row] = False
+                self._data[row, new_runs] = values
+            self._size += nb_runs
+    
+    def column(self, name):
+        return self._data[self._index[name], :self._size]
+    
+    def array(self):
+        return self._data[:, :self._size]
+    
+    def integer_columns(self):
+        return numpy.array(self._integer, dtype=bool)
+    
+    # Compute summary statistics of all metrics at once (reduction along the
+    # runs axis), result is a dict of arrays ordered as names()
+    def summary(self):
+        data = self.array()
+        summary = OrderedDict()
+        if data.size == 0:
+            empty = numpy.full(len(self._names), numpy.nan)
+            for stat in CalibrationData._npstats:
+                summary[stat] = empty
+        else:
+            with warnings.catch_warnings():
+                # metric without any value gives nan, that is expected
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                summary["amin"] = numpy.nanmin(data, axis=1)
+                summary["amax"] = numpy.nanmax(data, axis=1)
+                summary["mean"] = numpy.nanmean(data, axis=1)
+                summary["std"] = numpy.nanstd(data, axis=1)
+                summary["median"] = numpy.nanmedian(data, axis=1)
+        return summary
+    
+    def to_npz_dict(self, prefix):
+        return {prefix + "_names": numpy.array(self._names, dtype=str),
+                prefix + "_integer": self.integer_columns(),
+                prefix + "_data": self.array()}
+    
+    @classmethod
+    def from_npz_dict(cls, npz, prefix):
+        names = [str(name) for name in npz[prefix + "_names"]]
+        data = npz[prefix + "_data"]
+        columns = cls(capacity=max(data.shape[1], cls._initial_capacity))
+        for name, integer in zip(names, npz[prefix + "_integer"]):
+            columns._add_column(name, bool(integer))
+        columns._reserve(data.shape[1])
+        columns._data[:, :data.shape[1]] = data
+        columns._size = data.shape[1]
+        return columns
+
 
 class CalibrationData:
     _npstats = ["amin", "amax", "mean", "std", "median"]
@@ -32,41 +148,60 @@ class CalibrationData:
     def __init__(self):
         self._stats = {}
     
+    def _columns(self, level):
+        if level not in self._stats:
+            self._stats[level] = CalibrationColumns()
+        return self._stats[level]
+    
+    def levels(self):
+        return [level for level in iotracer.IoLevel if level in self._stats]
+    
+    def columns(self, level):
+        return self._stats.get(level)
+    
     def update_from_dict(self, level, data_d):
         if len(data_d) > 0:
-            dtype = numpy.dtype(
-                {'names': list(data_d.keys()),
-                 'formats': list(numpy.obj2sctype(v)
-                                 for v in list(data_d.values()))
-                 })
-            self.update_from_array(level,
-                                   numpy.array([tuple(list(data_d.values()))],
-                                               dtype=dtype))
+            self._columns(level).append(data_d)
     
     def update_from_array(self, level, array):
-        if level in self._stats.keys():
-            self._stats[level] = numpy.concatenate((self._stats[level],
-                                                    array))
-        else:
-            self._stats.update({level: array})
+        if array.dtype.names:
+            self._columns(level).extend(
+                {name: array[name] for name in array.dtype.names})
+    
+    def save(self, path):
+        npz_dict = {}
+        for level in self.levels():
+            npz_dict.update(self._stats[level].to_npz_dict(level.name))
+        numpy.savez_compressed(path, **npz_dict)
+    
+    def load(self, path):
+        with numpy.load(path) as npz:
+            for level in iotracer.IoLevel:
+                if level.name + "_names" in npz.files:
+                    self._stats[level] = CalibrationColumns.from_npz_dict(
+                        npz, level.name)
     
-    def _stats_to_str(self, array):
+    def _stats_to_str(self, columns):
         outstr = "data\t%s" % ("\t".join(self._npstats))
-        for data in array.dtype.names:
+        summary = columns.summary()
+        integer = columns.integer_columns()
+        for row, data in enumerate(columns.names()):
             datastr = "%s" % data
             for stat in self._npstats:
-                func = getattr(numpy, stat)
-                datastr = "\t".join([datastr, "%s" % (func(array[data]))])
+                value = summary[stat][row]
+                if (integer[row] and stat in ("amin", "amax") and
+                        not numpy.isnan(value)):
+                    value = int(value)
+                datastr = "\t".join([datastr, "%s" % value])
             outstr = "\n".join([outstr, datastr])
         return outstr
     
     def __str__(self):
         outstr = ""
-        for level in iotracer.IoLevel:
-            if level in self._stats.keys():
-                outstr = "\n".join([outstr,
-                                    "--- %s ---" % level.name,
-                                    self._stats_to_str(self._stats[level])])
+        for level in self.levels():
+            outstr = "\n".join([outstr,
+                                "--- %s ---" % level.name,
+                                self._stats_to_str(self._stats[level])])
         return outstr
 
 
@@ -237,23 +372,92 @@ class LevelParser:
 def get_log_calibration(args):
     dirpath = Path(args.directory)
     if not dirpath.is_dir():
-        parser.print_usage()
-        sys.exit(2)
+        args.parser.error('%s is not a directory' % args.directory)
     
     calibration = IoProfileLogCalibration(dirpath)
     calibration.execute()
+    if args.save:
+        calibration.save(args.save)
     print(calibration)
 
 
 def get_command_calibration(args):
     calibration = CommandCalibration(args.file, args.cmd, int(args.time))
     calibration.execute()
+    if args.save:
+        calibration.save(args.save)
     print(calibration)
 
 
-if __name__ == "__main__":
+def get_saved_calibration(args):
+    calibration = CalibrationData()
+    calibration.load(args.npzfile)
+    print(calibration)
+
+
+def _load_pattern_calibrations(args):
+    if args.pattern and len(args.npzfiles) > 1:
+        args.parser.error('--pattern requires a single npz file')
+    
+    calibrations = OrderedDict()
+    for npzfile in args.npzfiles:
+        calibration = CalibrationData()
+        calibration.load(npzfile)
+        calibrations[args.pattern or Path(npzfile).stem] = calibration
+    return calibrations
+
+
+def _database_key(args):
+    kernel = args.kernel or linux_utils.kernel_version()
+    module_version = args.module_version or linux_utils.iotracer_version()
+    if module_version is None:
+        print('iotracer module version is unknown, use --module-version')
+        sys.exit(2)
+    return kernel, module_version
+
+
+def store_calibration(args):
+    kernel, module_version = _database_key(args)
+    database = calibration_db.CalibrationDatabase(args.db)
+    for pattern, calibration in _load_pattern_calibrations(args).items():
+        nb_results = database.store(calibration, pattern, kernel,
+                                    module_version)
+        print('%s: %s results stored' % (pattern, nb_results))
+    database.close()
+
+
+def compare_calibration(args):
+    kernel, module_version = _database_key(args)
+    database = calibration_db.CalibrationDatabase(args.db)
+    diffs = database.compare(_load_pattern_calibrations(args),
+                             kernel, module_version,
+                             t_threshold=args.t_threshold,
+                             rel_threshold=args.rel_threshold / 100)
+    database.close()
+    
+    print("\t".join(["pattern", "level", "data", "base_mean", "mean",
+                     "diff", "t", "status"]))
+    nb_regressions = 0
+    for diff in diffs:
+        if diff.regression:
+            nb_regressions += 1
+        print("\t".join(["%s" % diff.pattern, diff.level, diff.metric,
+                         "%s" % diff.baseline_mean, "%s" % diff.mean,
+                         "%.2f%%" % (100 * diff.rel_diff),
+                         "%.2f" % diff.t_stat,
+                         "REGRESSION" if diff.regression else "ok"]))
+    if not diffs:
+        print('no baseline for kernel %s and iotracer %s' % (kernel,
+                                                             module_version))
+    elif nb_regressions > 0:
+        sys.exit(1)
+
+
+# Return parser of command line arguments
+def build_parser():
     # create the top-level parser
     parser = argparse.ArgumentParser()
+    instrumentation.add_arguments(parser)
     subparsers = parser.add_subparsers()
     
     # create the parser for the "log" command
@@ -262,7 +466,9 @@ if __name__ == "__main__":
         help='create from io_profile log directory')
     parser_log.add_argument('directory',
                             help='directory containing ioprofile log files')
-    parser_log.set_defaults(func=get_log_calibration)
+    parser_log.add_argument('--save', metavar='NPZFILE',
+                            help='save calibration data in a .npz file')
+    parser_log.set_defaults(func=get_log_calibration, parser=parser_log)
     
     # create the parser for the "cmd" command
     parser_cmd = subparsers.add_parser(
@@ -271,12 +477,60 @@ if __name__ == "__main__":
     parser_cmd.add_argument('cmd', help='command to execute')
     parser_cmd.add_argument('time', help='number of executions')
     parser_cmd.add_argument('file', help='file to monitor')
+    parser_cmd.add_argument('--save', metavar='NPZFILE',
+                            help='save calibration data in a .npz file')
     parser_cmd.set_defaults(func=get_command_calibration)
     
+    # create the parser for the "load" command
+    parser_load = subparsers.add_parser(
+        'load',
+        help='display calibration data saved in a .npz file')
+    parser_load.add_argument('npzfile', help='file containing saved data')
+    parser_load.set_defaults(func=get_saved_calibration)
+    
+    # options shared by commands using calibration database
+    db_parser = argparse.ArgumentParser(add_help=False)
+    db_parser.add_argument('--db', default='calibration.db',
+                           help='calibration database (default: %(default)s)')
+    db_parser.add_argument('--kernel',
+                           help='kernel version (default: running kernel)')
+    db_parser.add_argument('--module-version',
+                           help='iotracer version (default: loaded module)')
+    db_parser.add_argument('--pattern',
+                           help='I/O pattern (default: name of npz file)')
+    db_parser.add_argument('npzfiles', nargs='+',
+                           help='files containing saved calibration data')
+    
+    # create the parser for the "store" command
+    parser_store = subparsers.add_parser(
+        'store', parents=[db_parser],
+        help='store saved calibration data in calibration database')
+    parser_store.set_defaults(func=store_calibration, parser=parser_store)
+    
+    # create the parser for the "compare" command
+    parser_compare = subparsers.add_parser(
+        'compare', parents=[db_parser],
+        help='compare saved calibration data with stored baseline')
+    parser_compare.add_argument('--t-threshold', type=float, default=3.0,
+                                help='minimal |t| of a regression '
+                                     '(default: %(default)s)')
+    parser_compare.add_argument('--rel-threshold', type=float, default=5.0,
+                                help='minimal difference of means in '
+                                     'percentage (default: %(default)s)')
+    parser_compare.set_defaults(func=compare_calibration,
+                                parser=parser_compare)
+    
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    
     # parse argument lists
     args = parser.parse_args()
     
-    if len(vars(args)) > 0:
+    if hasattr(args, 'func'):
+        instrumentation.setup(args)
         # do the work
         args.func(args)
     else:
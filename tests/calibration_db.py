@@ -0,0 +1,216 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import sqlite3
+import time
+
+from collections import namedtuple
+
+import numpy
+
+calibration_key = namedtuple('calibration_key',
+                             'kernel module_version pattern level')
+
+metric_diff = namedtuple('metric_diff',
+                         'pattern level metric '
+                         'baseline_runs baseline_mean baseline_std '
+                         'runs mean std t_stat rel_diff regression')
+
+# Direction in which a metric gets worse: 1 when it increases, -1 when it
+# decreases, metrics not listed are worse in both directions
+_WORSE_DIRECTION = {'time': 1, 'dtr': -1, 'iops': -1, 'events': -1,
+                    'read_bytes': -1, 'write_bytes': -1}
+
+
+"""
+    Grouped statistics of a set of (group code, value) samples
+    All groups are reduced at once with numpy.bincount
+"""
+
+
+class _GroupStats:
+    def __init__(self, codes, values, nb_groups):
+        self.count = numpy.bincount(codes, minlength=nb_groups)
+        sums = numpy.bincount(codes, weights=values, minlength=nb_groups)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            self.mean = sums / self.count
+            deviation = values - self.mean[codes]
+            sq_sums = numpy.bincount(codes, weights=deviation * deviation,
+                                     minlength=nb_groups)
+            # unbiased variance, 0 when there is only one sample
+            self.var = numpy.where(self.count > 1,
+                                   sq_sums / (self.count - 1), 0.0)
+        self.std = numpy.sqrt(self.var)
+
+
+"""
+    Local SQLite database of calibration results
+    Results are keyed by kernel version, iotracer module version, I/O
+    pattern and level. Each row is the value of one metric for one run.
+"""
+
+
+class CalibrationDatabase:
+    _schema = [
+        """CREATE TABLE IF NOT EXISTS calibration_run (
+               run_id INTEGER PRIMARY KEY,
+               kernel TEXT NOT NULL,
+               module_version TEXT NOT NULL,
+               pattern TEXT NOT NULL,
+               level TEXT NOT NULL,
+               date REAL NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS calibration_value (
+               run_id INTEGER NOT NULL REFERENCES calibration_run(run_id),
+               metric TEXT NOT NULL,
+               value REAL NOT NULL)""",
+        """CREATE INDEX IF NOT EXISTS calibration_run_key
+               ON calibration_run(kernel, module_version, pattern, level)""",
+        """CREATE INDEX IF NOT EXISTS calibration_value_run
+               ON calibration_value(run_id)""",
+    ]
+    
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        with self._db:
+            for statement in self._schema:
+                self._db.execute(statement)
+    
+    def close(self):
+        self._db.close()
+    
+    def __del__(self):
+        self._db.close()
+    
+    # Store all runs of a CalibrationData object for an I/O pattern
+    # Return number of (run, level) results stored
+    def store(self, calibration, pattern, kernel, module_version):
+        nb_runs = 0
+        date = time.time()
+        with self._db:
+            for level in calibration.levels():
+                columns = calibration.columns(level)
+                names = columns.names()
+                data = columns.array()
+                for run in range(data.shape[1]):
+                    cursor = self._db.execute(
+                        "INSERT INTO calibration_run"
+                        " (kernel, module_version, pattern, level, date)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (kernel, module_version, pattern, level.name, date))
+                    self._db.executemany(
+                        "INSERT INTO calibration_value VALUES (?, ?, ?)",
+                        [(cursor.lastrowid, name, float(value))
+                         for name, value in zip(names, data[:, run])
+                         if not numpy.isnan(value)])
+                    nb_runs += 1
+        return nb_runs
+    
+    def keys(self):
+        cursor = self._db.execute(
+            "SELECT DISTINCT kernel, module_version, pattern, level"
+            " FROM calibration_run ORDER BY kernel, module_version,"
+            " pattern, level")
+        return [calibration_key(*row) for row in cursor]
+    
+    # Return baseline values of a set of patterns as three arrays:
+    # group index in groups list, value and list of (pattern, level, metric)
+    # groups
+    def baseline(self, patterns, kernel, module_version):
+        patterns = list(patterns)
+        cursor = self._db.execute(
+            "SELECT r.pattern, r.level, v.metric, v.value"
+            " FROM calibration_run r"
+            " JOIN calibration_value v ON v.run_id = r.run_id"
+            " WHERE r.kernel = ? AND r.module_version = ?"
+            " AND r.pattern IN (%s)" % ", ".join("?" * len(patterns)),
+            [kernel, module_version] + patterns)
+        rows = cursor.fetchall()
+        groups = {}
+        codes = numpy.fromiter(
+            (groups.setdefault(row[:3], len(groups)) for row in rows),
+            dtype=numpy.intp, count=len(rows))
+        values = numpy.fromiter((row[3] for row in rows),
+                                dtype=numpy.float64, count=len(rows))
+        return codes, values, list(groups)
+    
+    """
+        Compare calibration data of a set of patterns (dict whose keys are
+        pattern names and values are CalibrationData objects) with the
+        baseline stored for the same kernel and module version.
+        For each metric, Welch's t statistic of the difference of means is
+        computed for all metrics at once. A metric is reported as a
+        regression when t and the relative difference of means, taken in
+        the direction in which the metric gets worse (both directions if it
+        has none, see _WORSE_DIRECTION), are greater than t_threshold and
+        rel_threshold: improvements are not regressions.
+    """
+    
+    def compare(self, calibrations, kernel, module_version,
+                t_threshold=3.0, rel_threshold=0.05):
+        base_codes, base_values, groups = self.baseline(calibrations.keys(),
+                                                        kernel,
+                                                        module_version)
+        group_index = {group: code for code, group in enumerate(groups)}
+        new_codes = []
+        new_values = []
+        for pattern, calibration in calibrations.items():
+            for level in calibration.levels():
+                columns = calibration.columns(level)
+                for name, row in zip(columns.names(), columns.array()):
+                    group = (pattern, level.name, name)
+                    if group in group_index:
+                        row = row[~numpy.isnan(row)]
+                        new_codes.append(numpy.full(len(row),
+                                                    group_index[group],
+                                                    dtype=numpy.intp))
+                        new_values.append(row)
+        
+        diffs = []
+        if new_codes:
+            base = _GroupStats(base_codes, base_values, len(groups))
+            new = _GroupStats(numpy.concatenate(new_codes),
+                              numpy.concatenate(new_values), len(groups))
+            
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                delta = new.mean - base.mean
+                stderr = numpy.sqrt(base.var / base.count +
+                                    new.var / new.count)
+                t_stat = numpy.where(stderr > 0, delta / stderr,
+                                     numpy.where(delta == 0, 0.0,
+                                                 numpy.copysign(numpy.inf,
+                                                                delta)))
+                rel_diff = numpy.where(base.mean != 0,
+                                       delta / numpy.abs(base.mean),
+                                       numpy.where(delta == 0, 0.0,
+                                                   numpy.copysign(numpy.inf,
+                                                                  delta)))
+            direction = numpy.array([_WORSE_DIRECTION.get(metric, 0)
+                                     for (_, _, metric) in groups])
+            worse_t = numpy.where(direction == 0, numpy.abs(t_stat),
+                                  direction * t_stat)
+            worse_rel = numpy.where(direction == 0, numpy.abs(rel_diff),
+                                    direction * rel_diff)
+            regression = ((worse_t > t_threshold) &
+                          (worse_rel > rel_threshold))
+            
+            for code in numpy.flatnonzero(new.count > 0):
+                (pattern, level, metric) = groups[code]
+                diffs.append(metric_diff(pattern, level, metric,
+                                         int(base.count[code]),
+                                         base.mean[code], base.std[code],
+                                         int(new.count[code]),
+                                         new.mean[code], new.std[code],
+                                         t_stat[code], rel_diff[code],
+                                         bool(regression[code])))
+        return diffs
@@ -0,0 +1,143 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import heapq
+
+import iotracer
+
+
+# Convert a log timestamp ("<sec>.<nsec>") to integer nanoseconds, so that
+# timestamps are compared without float rounding
+def timestamp_ns(timestamp):
+    (sec, _, nsec) = timestamp.partition('.')
+    return int(sec) * 1000000000 + int(nsec[:9].ljust(9, '0'))
+
+
+# How far out of order events of a log were
+# out_of_order: events with a timestamp lower than a previous event
+# max_delay: maximal lateness (in seconds) of an event compared to the
+#            greatest previous timestamp
+# max_displacement: maximal distance (in events) between input and output
+#                   positions of an event
+# late: events still out of order after reordering (lookahead too small)
+class ReorderStats:
+    def __init__(self):
+        self.events = 0
+        self.out_of_order = 0
+        self.max_delay = 0.0
+        self.max_displacement = 0
+        self.late = 0
+    
+    def __str__(self):
+        return ("events=%s out_of_order=%s max_delay=%.9f"
+                " max_displacement=%s late=%s" % (
+                    self.events, self.out_of_order, self.max_delay,
+                    self.max_displacement, self.late))
+
+
+"""
+    Log whose events are merged into timestamp order
+    The kernel module takes the timestamp of an event after reserving its
+    slot in the log, so concurrent events may be logged out of order.
+    Events go through a heap holding at most lookahead events: an event is
+    put back in order if it is late by less than lookahead events.
+    Statistics of the last iteration are available in reorder_stats
+"""
+
+
+class ReorderedLog(iotracer.IoTracerLog):
+    def __init__(self, iotracer_log, lookahead=1024):
+        self._iotracer_log = iotracer_log
+        self._lookahead = lookahead
+        self.reorder_stats = ReorderStats()
+    
+    def __iter__(self):
+        return self.events()
+    
+    def events(self, level=None, **filters):
+        return self._reordered(self._iotracer_log.events(level, **filters))
+    
+    def _reordered(self, events):
+        stats = ReorderStats()
+        self.reorder_stats = stats
+        heap = []
+        max_time = None
+        last_output = None
+        position = 0
+        for (index, event) in enumerate(events):
+            time = timestamp_ns(event.time)
+            if max_time is None or time >= max_time:
+                max_time = time
+            else:
+                stats.out_of_order += 1
+                stats.max_delay = max(stats.max_delay,
+                                      (max_time - time) / 1e9)
+            heapq.heappush(heap, (time, index, event))
+            if len(heap) > self._lookahead:
+                (time, input_index, event) = heapq.heappop(heap)
+                if last_output is not None and time < last_output:
+                    stats.late += 1
+                last_output = time
+                stats.max_displacement = max(stats.max_displacement,
+                                             abs(position - input_index))
+                position += 1
+                yield event
+        while heap:
+            (time, input_index, event) = heapq.heappop(heap)
+            if last_output is not None and time < last_output:
+                stats.late += 1
+            last_output = time
+            stats.max_displacement = max(stats.max_displacement,
+                                         abs(position - input_index))
+            position += 1
+            yield event
+        stats.events = position
+
+
+# Format an event as a line of iotracer log
+def event_line(event):
+    line = '%s;%s;%s;%s;%s;%s;%s' % (event.time, event.type, event.address,
+                                    event.size, event.level.name,
+                                    event.task_name, event.task_pid)
+    if event.file_id is not None:
+        line += ';%s' % event.file_id
+    return line + '\n'
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser(
+        description='put events of an iotracer log in timestamp order and'
+                    ' report how far out of order they were')
+    parser.add_argument('iotracerlog', help='file containing iotracer log')
+    parser.add_argument('--lookahead', type=int, default=1024,
+                        help='number of events held to reorder'
+                             ' (default: %(default)s)')
+    parser.add_argument('--output',
+                        help='file where reordered log is written')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    reordered_log = ReorderedLog(iotracer.IoTracerLog(args.iotracerlog),
+                                 args.lookahead)
+    if args.output:
+        with open(args.output, 'w') as output:
+            for event in reordered_log:
+                output.write(event_line(event))
+    else:
+        for event in reordered_log:
+            pass
+    print(reordered_log.reorder_stats)
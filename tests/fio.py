@@ -12,8 +12,11 @@
 # FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
 # more details.
 
+import json
 import subprocess
 
+import linux_utils
+
 
 # fio job statistics
 class JobStat:
@@ -130,10 +133,58 @@ class JobStat:
                                                            self.disk)
 
 
+# fio job statistics from JSON output (--output-format=json)
+# Fields are read by name, so it does not depend on fio version
+class JsonJobStat(JobStat):
+    def _parse_io_stats(self, fio_stats):
+        # io_bytes was in KB before fio 2.x added io_kbytes
+        if 'io_kbytes' in fio_stats:
+            iosize = fio_stats['io_kbytes']
+        else:
+            iosize = fio_stats['io_bytes']
+        return JobStat.IoStat(int(iosize),
+                              int(fio_stats['bw']),
+                              int(round(fio_stats['iops'])),
+                              int(fio_stats['runtime']))
+    
+    def _parse_cpu_stats(self, fio_stats):
+        return JobStat.CpuStat('%.6f%%' % fio_stats['usr_cpu'],
+                               '%.6f%%' % fio_stats['sys_cpu'],
+                               int(fio_stats['ctx']))
+    
+    def _parse_disk_stats(self, fio_stats):
+        return JobStat.DiskStat(fio_stats['name'],
+                                {'read': fio_stats['read_ios'],
+                                 'write': fio_stats['write_ios']},
+                                {'read': fio_stats['read_merges'],
+                                 'write': fio_stats['write_merges']},
+                                {'read': fio_stats['read_ticks'],
+                                 'write': fio_stats['write_ticks']},
+                                fio_stats['in_queue'],
+                                '%.2f%%' % fio_stats['util'])
+    
+    # Disk statistics are the ones of the disk holding the file of the job
+    # (None if it is not found in fio_disk_util)
+    def __init__(self, fio_job, fio_disk_util):
+        self.name = fio_job['jobname']
+        self.group = fio_job['groupid']
+        self.error = fio_job.get('error', 0)
+        self.read = self._parse_io_stats(fio_job['read'])
+        self.write = self._parse_io_stats(fio_job['write'])
+        self.cpu = self._parse_cpu_stats(fio_job)
+        self.disk = None
+        filename = fio_job.get('job options', {}).get('filename')
+        device = linux_utils.block_device_name(filename) if filename else None
+        for disk_stats in fio_disk_util:
+            if disk_stats['name'] == device:
+                self.disk = self._parse_disk_stats(disk_stats)
+
+
 # fio job
 class Job:
     def __init__(self, jobname, filename, filesize, blocksize=4096,
-                 write=True, read=True, random=False, numloops=1):
+                 write=True, read=True, random=False, numloops=1,
+                 ioengine=None, new_group=False):
         self._jobname = jobname
         if write:
             if read:
@@ -157,6 +208,13 @@ class Job:
             'filename': filename,
             'filesize': '%sk' % filesize
         }
+        # job specific engine overrides engine of the Executor
+        if ioengine:
+            self._args['ioengine'] = ioengine
+        # job waits for end of previous jobs and starts a new group
+        if new_group:
+            self._args['stonewall'] = None
+            self._args['new_group'] = None
     
     def name(self):
         return self._jobname
@@ -164,11 +222,16 @@ class Job:
     def args(self):
         argstr = ''
         for k, v in self._args.items():
-            argstr += '--{0}={1} '.format(k, v)
+            if v is None:
+                argstr += '--{0} '.format(k)
+            else:
+                argstr += '--{0}={1} '.format(k, v)
         return argstr
 
 
 # Interface to fio process for execution of jobs
+# All jobs are executed by one fio process: jobs of a group run
+# concurrently and groups run one after the other (see Job new_group)
 class Executor:
     class FioTerseOutput:
         
@@ -176,8 +239,11 @@ class Executor:
             self._stats = {}
             lines = fio_output.splitlines()
             for line in lines:
-                fio_stats = fio_output.split(';')
-                jobname = fio_stats[2]
+                fio_stats = line.split(';')
+                if len(fio_stats) <= JobStat._job_name_pos:
+                    # not a terse output line (fio warning)
+                    continue
+                jobname = fio_stats[JobStat._job_name_pos]
                 jobstat = JobStat(line)
                 self._stats.update({jobname: jobstat})
         
@@ -187,14 +253,38 @@ class Executor:
                 job_stat = self._stats[jobname]
             return job_stat
     
-    def __init__(self, joblist, ioengine="libaio"):
+    class FioJsonOutput(FioTerseOutput):
+        
+        def __init__(self, fio_output):
+            self._stats = {}
+            # skip messages printed by fio before JSON data
+            start = fio_output.find('{')
+            if start < 0:
+                raise ValueError('no JSON data in fio output')
+            (data, end) = json.JSONDecoder().raw_decode(fio_output[start:])
+            disk_util = data.get('disk_util', [])
+            for job in data['jobs']:
+                jobstat = JsonJobStat(job, disk_util)
+                self._stats.update({jobstat.name: jobstat})
+        
+        def groups(self):
+            groups = {}
+            for jobname, jobstat in self._stats.items():
+                groups.setdefault(jobstat.group, []).append(jobname)
+            return groups
+    
+    def __init__(self, joblist, ioengine="libaio", output_format="json"):
         self._joblist = joblist
         self._ioengine = ioengine
+        self._output_format = output_format
         self._fio_output = None
     
     def execute(self):
         #        cmd = 'fio --minimal --debug=process --gtod_reduce=1'
-        cmd = 'fio --minimal --gtod_reduce=1'
+        if self._output_format == 'json':
+            cmd = 'fio --output-format=json --gtod_reduce=1'
+        else:
+            cmd = 'fio --minimal --gtod_reduce=1'
         cmd = " ".join([cmd,
                         '--name=global --ioengine=%s --end_fsync=1'
                         % self._ioengine])
@@ -212,7 +302,10 @@ class Executor:
             print('Failed to execute command "%s"' % cmd)
             raise
         else:
-            self._fio_output = Executor.FioTerseOutput(out)
+            if self._output_format == 'json':
+                self._fio_output = Executor.FioJsonOutput(out)
+            else:
+                self._fio_output = Executor.FioTerseOutput(out)
     
     def jobstat(self, job):
         job_stat = None
@@ -0,0 +1,164 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import sys
+
+import numpy
+import iotracer
+import iotracer_arrays
+import vfs_block_info
+
+
+"""
+    Return offsets in replay target of a chunk of events (IoEventArrays) of
+    a level and mask of events that could be mapped
+    VFS addresses are offsets in the traced file. BLK sectors are converted
+    to offsets in the traced file with index (a PhysicalExtentsIndex of the
+    file) or, if index is None, to offsets in the block device.
+"""
+
+
+def target_offsets(events, level, index=None):
+    if level is iotracer.IoLevel.VFS:
+        return events.address, numpy.ones(len(events), dtype=bool)
+    elif index is None:
+        return events.address * 512, numpy.ones(len(events), dtype=bool)
+    else:
+        (file_index, offset) = index.files_from_sectors(events.address)
+        return offset, file_index >= 0
+
+
+"""
+    Conversion of an iotracer log to a fio iolog (version 2) that can be
+    replayed with fio --read_iolog
+
+    Events of one level are converted, see target_offsets().
+    Inter-arrival gaps are converted to fio "wait" entries (in microseconds)
+    divided by speed. fio does not sleep for less than about 100 us, so
+    gaps shorter than min_wait are not written but added to the next wait,
+    and the replay keeps the pace of the trace. With speed 0, there is no
+    wait entry and the log is replayed as fast as possible.
+    Log is converted by chunks of events, so its size is not limited by
+    memory.
+"""
+
+
+class FioIologConverter:
+    _header = "fio version 2 iolog"
+    
+    def __init__(self, target, level=iotracer.IoLevel.VFS,
+                 file_extents=None, speed=1.0, min_wait=100):
+        if not isinstance(level, iotracer.IoLevel):
+            raise TypeError
+        if level is iotracer.IoLevel.FS:
+            raise ValueError('FS level events can not be replayed')
+        self._target = target
+        self._level = level
+        self._speed = speed
+        self._min_wait = min_wait
+        self._index = None
+        if file_extents is not None:
+            self._index = vfs_block_info.PhysicalExtentsIndex([file_extents])
+        
+        self.nb_events = 0
+        self.nb_unmapped = 0
+        # wait not written yet, in microseconds
+        self._pending_wait = 0.0
+    
+    # Return fio iolog lines corresponding to a chunk of events
+    # prev_time is the time of the event preceding the chunk (or None)
+    def _chunk_lines(self, events, prev_time):
+        (offsets, mapped) = target_offsets(events, self._level, self._index)
+        self.nb_unmapped += int(len(events) - mapped.sum())
+        events = events.select(mapped)
+        offsets = offsets[mapped]
+        
+        waits = None
+        if self._speed > 0 and len(events) > 0:
+            times = events.time
+            if prev_time is not None:
+                times = numpy.concatenate(([prev_time], times))
+            else:
+                times = numpy.concatenate(([times[0]], times))
+            waits = (numpy.maximum(numpy.diff(times), 0) *
+                     1e6 / self._speed).tolist()
+        
+        target = self._target
+        actions = numpy.where(events.write, 'write', 'read')
+        lines = []
+        for i, (action, offset, size) in enumerate(
+                zip(actions.tolist(), offsets.tolist(),
+                    events.size.tolist())):
+            if waits is not None:
+                self._pending_wait += waits[i]
+                if self._pending_wait >= self._min_wait:
+                    wait = int(round(self._pending_wait))
+                    # rounding error is carried over too
+                    self._pending_wait -= wait
+                    lines.append("%s wait %s 0" % (target, wait))
+            lines.append("%s %s %s %s" % (target, action, offset, size))
+        self.nb_events += len(events)
+        return lines, (events.time[-1] if len(events) > 0 else prev_time)
+    
+    def convert(self, iotracer_log, output):
+        print(self._header, file=output)
+        print("%s add" % self._target, file=output)
+        print("%s open" % self._target, file=output)
+        self._pending_wait = 0.0
+        prev_time = None
+        for events in iotracer_arrays.iter_event_arrays(iotracer_log,
+                                                        self._level):
+            (lines, prev_time) = self._chunk_lines(events, prev_time)
+            if lines:
+                output.write("\n".join(lines))
+                output.write("\n")
+        print("%s close" % self._target, file=output)
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iotracerlog', help='file containing iotracer log')
+    parser.add_argument('target',
+                        help='file or block device used by fio to replay')
+    parser.add_argument('--level', choices=['VFS', 'BLK'], default='VFS',
+                        help='level of events to replay (default: VFS)')
+    parser.add_argument('--filefrag',
+                        help='file containing output of command filefrag -v'
+                             ' for the traced file, used to convert BLK'
+                             ' addresses to offsets in the file')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed factor, 0 to replay as fast as'
+                             ' possible (default: %(default)s)')
+    parser.add_argument('--output', help='fio iolog file (default: stdout)')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    file_extents = None
+    if args.filefrag:
+        file_extents = vfs_block_info.FileExtentsList(
+            vfs_block_info.FilefragOutputParser(args.filefrag))
+    converter = FioIologConverter(args.target,
+                                  getattr(iotracer.IoLevel, args.level),
+                                  file_extents, args.speed)
+    if args.output:
+        with open(args.output, 'w') as output:
+            converter.convert(iotracer.IoTracerLog(args.iotracerlog), output)
+    else:
+        converter.convert(iotracer.IoTracerLog(args.iotracerlog), sys.stdout)
+    if converter.nb_unmapped > 0:
+        print('%s events not in traced file were dropped' %
+              converter.nb_unmapped, file=sys.stderr)
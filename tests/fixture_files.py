@@ -0,0 +1,80 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import os
+import re
+
+
+"""
+    Test files preallocated with posix_fallocate and kept between test runs
+
+    Files are stored in a subdirectory of directory specific to its file
+    system and their name contains their size, so a file is reused by later
+    runs asking for the same size on the same file system.
+"""
+
+
+class PreallocatedFiles:
+    _file_pattern = re.compile(r"^.+-(?P<size>\d+)k\.bin$")
+    
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        # file system identifier
+        self._directory = os.path.join(directory,
+                                       'fs_%x' % os.stat(directory).st_dev)
+        os.makedirs(self._directory, exist_ok=True)
+        self.block_size = os.statvfs(self._directory).f_bsize
+    
+    def _files(self):
+        for name in os.listdir(self._directory):
+            if self._file_pattern.match(name):
+                yield os.path.join(self._directory, name)
+    
+    # Number of available blocks, not counting blocks used by test files
+    # (they can be reused or replaced)
+    def available_blocks(self):
+        used_blocks = 0
+        for path in self._files():
+            used_blocks += os.stat(path).st_blocks * 512 // self.block_size
+        return os.statvfs(self._directory).f_bavail + used_blocks
+    
+    def path(self, name, size):
+        return os.path.join(self._directory, '%s-%sk.bin' % (name, size))
+    
+    # Return path of a test file of size kB, create it if needed
+    # Test files with the same name and another size are removed
+    def get(self, name, size):
+        path = self.path(name, size)
+        for other in self._files():
+            if (os.path.basename(other).startswith(name + '-') and
+                    other != path):
+                os.remove(other)
+        
+        if (not os.path.exists(path) or
+                os.stat(path).st_size != size * 1024):
+            fd = os.open(path, os.O_CREAT | os.O_WRONLY, 0o644)
+            try:
+                os.ftruncate(fd, 0)
+                os.posix_fallocate(fd, 0, size * 1024)
+            except OSError:
+                os.close(fd)
+                os.remove(path)
+                raise
+            else:
+                os.close(fd)
+        return path
+    
+    def remove_all(self):
+        for path in list(self._files()):
+            os.remove(path)
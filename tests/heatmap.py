@@ -0,0 +1,245 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import struct
+import zlib
+
+import numpy
+import iotracer
+import iotracer_arrays
+
+
+# Return smallest power of two greater than or equal to value (at least 1)
+def _power_of_two(value):
+    return 1 << max(int(numpy.ceil(value)) - 1, 0).bit_length()
+
+
+"""
+    Time x address 2-D histogram of the events of one level, per access type
+    Events are accumulated chunk by chunk in a fixed (2, address_bins,
+    time_bins) array (reads then writes), so memory does not depend on the
+    length of the trace. Each event is counted in the bin of its start
+    address, weighted by its size ('bytes') or by 1 ('events').
+    Without a range, bins of a dimension start at the first timestamp (time)
+    or at 0 (address) and their width is doubled (merging pairs of bins)
+    each time an event falls beyond the last bin. Events before the first
+    time bin are counted in it. With a range, events out of it are only
+    counted in out_of_range.
+    As folding may leave the last time bins empty, reads, writes, time edges
+    and the image are cropped after the last non-empty time bin when there
+    is no time range.
+"""
+
+
+class Heatmap:
+    def __init__(self, time_bins=1024, address_bins=1024, weight='bytes',
+                 time_range=None, address_range=None):
+        if weight not in ('bytes', 'events'):
+            raise ValueError('unknown weight %s' % weight)
+        if time_range is None and time_bins % 2 != 0:
+            raise ValueError('number of time bins must be even')
+        if address_range is None and address_bins % 2 != 0:
+            raise ValueError('number of address bins must be even')
+        self.weight = weight
+        self.counts = numpy.zeros((2, address_bins, time_bins),
+                                  dtype=numpy.float64)
+        self.out_of_range = 0
+        self._fixed_time = time_range is not None
+        self._fixed_address = address_range is not None
+        (self.time_origin, self.time_width) = (None, None)
+        (self.address_origin, self.address_width) = (0, None)
+        if time_range is not None:
+            self.time_origin = float(time_range[0])
+            self.time_width = (float(time_range[1]) -
+                               self.time_origin) / time_bins
+        if address_range is not None:
+            self.address_origin = int(address_range[0])
+            self.address_width = max((int(address_range[1]) -
+                                      self.address_origin) / address_bins,
+                                     1)
+    
+    @property
+    def time_bins(self):
+        return self.counts.shape[2]
+    
+    @property
+    def address_bins(self):
+        return self.counts.shape[1]
+    
+    # Number of time bins up to the last non-empty one (all bins with a
+    # time range)
+    def used_time_bins(self):
+        if self._fixed_time:
+            return self.time_bins
+        used = numpy.flatnonzero(self.counts.any(axis=(0, 1)))
+        return int(used[-1]) + 1 if len(used) else 1
+    
+    @property
+    def reads(self):
+        return self.counts[0, :, :self.used_time_bins()]
+    
+    @property
+    def writes(self):
+        return self.counts[1, :, :self.used_time_bins()]
+    
+    def time_edges(self):
+        return self.time_origin + self.time_width * numpy.arange(
+            self.used_time_bins() + 1)
+    
+    def address_edges(self):
+        return self.address_origin + self.address_width * numpy.arange(
+            self.address_bins + 1)
+    
+    # Double width of bins of the last axis of counts
+    @staticmethod
+    def _fold(counts):
+        shape = counts.shape[:-1] + (counts.shape[-1] // 2, 2)
+        folded = counts.reshape(shape).sum(axis=-1)
+        return numpy.concatenate([folded, numpy.zeros_like(folded)], axis=-1)
+    
+    def _extend(self, events):
+        if not self._fixed_time:
+            if self.time_origin is None:
+                self.time_origin = float(events.time.min())
+                # the last event falls in the last bin, not beyond it
+                self.time_width = max(
+                    float(events.time.max() - self.time_origin) /
+                    (self.time_bins - 1), 1e-6)
+            while (events.time.max() >=
+                   self.time_origin + self.time_width * self.time_bins):
+                self.counts = self._fold(self.counts)
+                self.time_width *= 2
+        if not self._fixed_address:
+            if self.address_width is None:
+                self.address_width = _power_of_two(
+                    (events.address.max() + 1) / self.address_bins)
+            while (events.address.max() >=
+                   self.address_width * self.address_bins):
+                self.counts = numpy.ascontiguousarray(
+                    self._fold(self.counts.swapaxes(1, 2)).swapaxes(1, 2))
+                self.address_width *= 2
+    
+    # Account a chunk of events (IoEventArrays) of one level
+    def update(self, events):
+        if len(events) == 0:
+            return
+        self._extend(events)
+        time_bin = numpy.floor((events.time - self.time_origin) /
+                               self.time_width).astype(numpy.int64)
+        address_bin = ((events.address - self.address_origin) //
+                       self.address_width).astype(numpy.int64)
+        if not self._fixed_time:
+            numpy.maximum(time_bin, 0, out=time_bin)
+        selected = ((time_bin >= 0) & (time_bin < self.time_bins) &
+                    (address_bin >= 0) & (address_bin < self.address_bins))
+        self.out_of_range += len(events) - int(selected.sum())
+        
+        slot = ((events.write[selected] * self.address_bins +
+                 address_bin[selected]) * self.time_bins +
+                time_bin[selected])
+        weights = events.size[selected] if self.weight == 'bytes' else None
+        self.counts += numpy.bincount(
+            slot, weights=weights,
+            minlength=self.counts.size).reshape(self.counts.shape)
+    
+    # Account events of a level of an iotracer log file
+    def update_from_file(self, path, level=iotracer.IoLevel.BLK,
+                         block_size=16 << 20):
+        for events in iotracer_arrays.read_event_arrays(path, level,
+                                                        block_size):
+            self.update(events)
+        return self
+    
+    def save_npz(self, path, **metadata):
+        numpy.savez_compressed(path, reads=self.reads, writes=self.writes,
+                               time_edges=self.time_edges(),
+                               address_edges=self.address_edges(),
+                               weight=self.weight, **metadata)
+    
+    # Return the heatmap as a (address_bins, used time bins, 3) uint8 RGB
+    # image, lowest addresses at the bottom: writes in red, reads in green
+    # and blue, on a logarithmic scale
+    def image(self):
+        scale = numpy.log1p(self.counts.max()) if self.counts.any() else 1
+        (reads, writes) = [(numpy.log1p(c) / scale * 255).astype(numpy.uint8)
+                           for c in (self.reads, self.writes)]
+        return numpy.stack([writes, reads, reads], axis=-1)[::-1]
+    
+    def save_png(self, path):
+        with open(path, 'wb') as output:
+            output.write(png(self.image()))
+
+
+# Return a PNG chunk
+def _png_chunk(chunk_type, data):
+    return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+# Return PNG file content of a (height, width, 3) uint8 RGB image
+def png(image):
+    (height, width, _) = image.shape
+    # each row starts with its filter type (0: none)
+    rows = numpy.zeros((height, 1 + width * 3), dtype=numpy.uint8)
+    rows[:, 1:] = image.reshape(height, width * 3)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                        8, 2, 0, 0, 0)),
+        _png_chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)),
+        _png_chunk(b'IEND', b'')])
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iotracerlog', help='file containing iotracer log')
+    parser.add_argument('--level', choices=[l.name for l in iotracer.IoLevel],
+                        default='BLK', help='level of events (default: BLK)')
+    parser.add_argument('--time-bins', type=int, default=1024,
+                        help='number of time bins (image width)')
+    parser.add_argument('--address-bins', type=int, default=1024,
+                        help='number of address bins (image height)')
+    parser.add_argument('--weight', choices=['bytes', 'events'],
+                        default='bytes', help='count bytes or events')
+    parser.add_argument('--time-range', type=float, nargs=2,
+                        metavar=('START', 'END'),
+                        help='range of timestamps (default: whole log)')
+    parser.add_argument('--address-range', type=int, nargs=2,
+                        metavar=('START', 'END'),
+                        help='range of addresses (default: from 0 to the'
+                             ' highest address)')
+    parser.add_argument('--png', help='write heatmap in a PNG image')
+    parser.add_argument('--npz', help='write heatmap arrays in a NPZ file')
+
+    # parse argument lists
+    args = parser.parse_args()
+
+    level = iotracer.IoLevel[args.level]
+    heatmap = Heatmap(args.time_bins, args.address_bins, args.weight,
+                      args.time_range, args.address_range)
+    heatmap.update_from_file(args.iotracerlog, level)
+    if heatmap.time_origin is None:
+        print('no %s events' % level.name)
+    else:
+        if args.png:
+            heatmap.save_png(args.png)
+        if args.npz:
+            heatmap.save_npz(args.npz, level=level.name)
+        print('time: %s + %s s per bin' % (heatmap.time_origin,
+                                           heatmap.time_width))
+        print('address: %s + %s per bin' % (heatmap.address_origin,
+                                            heatmap.address_width))
+        print('events out of range: %s' % heatmap.out_of_range)
@@ -0,0 +1,185 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import atexit
+import sys
+import time
+
+from collections import OrderedDict
+
+
+"""
+    Opt-in instrumentation of the analysis pipeline
+    enable() wraps hot functions (listed in _hooks) of already imported
+    modules with timers and counters, and reports them at exit on stderr
+    with tracemalloc peak memory. Nothing is wrapped until enable() is
+    called, so instrumentation costs nothing when disabled.
+    Timers are inclusive: the time of a function includes the time of
+    instrumented functions it calls.
+"""
+
+
+class Timer:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+        self.bytes = 0
+    
+    def __str__(self):
+        rate = self.items / self.seconds if self.seconds > 0 else 0.0
+        byte_rate = self.bytes / self.seconds if self.seconds > 0 else 0.0
+        return "%s\t%s\t%.6f\t%s\t%.0f\t%s\t%.0f" % (
+            self.name, self.calls, self.seconds, self.items, rate,
+            self.bytes, byte_rate)
+
+
+timers = OrderedDict()
+_wrapped = []
+_start_time = None
+
+
+def timer(name):
+    if name not in timers:
+        timers[name] = Timer(name)
+    return timers[name]
+
+
+# Count one event and its I/O bytes
+def _count_event(t, event):
+    t.items += 1
+    t.bytes += event.size
+
+
+def _count_stats(t, stats):
+    if stats:
+        t.items += stats.events
+        t.bytes += stats.read_bytes + stats.write_bytes
+
+
+def _count_call(t, result):
+    t.items += 1
+
+
+# (class name, method name, timer name, counting function)
+_hooks = [
+    ('_IoTracerIterator', '__next__', 'parse', _count_event),
+    ('IoProfiler', 'stats', 'stats', _count_stats),
+    ('CalibrationData', 'update_from_dict', 'calibration_update',
+     _count_call),
+    ('CalibrationData', 'update_from_array', 'calibration_update',
+     _count_call),
+    ('IoTracerStats', '__str__', 'output', _count_call),
+    ('CalibrationData', '__str__', 'output', _count_call),
+]
+
+# modules whose classes are instrumented (__main__ for scripts)
+_modules = ['iotracer', 'io_profile', 'calibration', '__main__']
+
+
+def _wrap(cls, attr, t, count):
+    original = cls.__dict__[attr]
+    perf_counter = time.perf_counter
+    
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            result = original(*args, **kwargs)
+        finally:
+            t.seconds += perf_counter() - start
+            t.calls += 1
+        count(t, result)
+        return result
+    
+    wrapper.__wrapped__ = original
+    setattr(cls, attr, wrapper)
+    _wrapped.append((cls, attr, original))
+
+
+def enabled():
+    return _start_time is not None
+
+
+# Instrument hot functions and report at exit
+def enable(trace_malloc=True):
+    global _start_time
+    if enabled():
+        return
+    _start_time = time.perf_counter()
+    done = set()
+    for module_name in _modules:
+        module = sys.modules.get(module_name)
+        for (cls_name, attr, name, count) in _hooks:
+            cls = getattr(module, cls_name, None)
+            if (cls is None or attr not in cls.__dict__ or
+                    (cls, attr) in done):
+                continue
+            done.add((cls, attr))
+            _wrap(cls, attr, timer(name), count)
+    if trace_malloc:
+        import tracemalloc
+        tracemalloc.start()
+    atexit.register(report)
+
+
+# Remove instrumentation
+def disable():
+    global _start_time
+    while _wrapped:
+        (cls, attr, original) = _wrapped.pop()
+        setattr(cls, attr, original)
+    _start_time = None
+
+
+def report(output=None):
+    output = output or sys.stderr
+    if not enabled():
+        return
+    print("timer\tcalls\tseconds\titems\titems/s\tbytes\tbytes/s",
+          file=output)
+    for t in timers.values():
+        print(t, file=output)
+    print("total\t\t%.6f" % (time.perf_counter() - _start_time), file=output)
+    if 'tracemalloc' in sys.modules:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            (current, peak) = tracemalloc.get_traced_memory()
+            print("tracemalloc peak=%s current=%s" % (peak, current),
+                  file=output)
+
+
+def _dump_profile(profiler, path):
+    profiler.disable()
+    profiler.dump_stats(path)
+
+
+# Add --instrument and --profile options to a command line parser
+def add_arguments(parser):
+    parser.add_argument('--instrument', action='store_true',
+                        help='report timers, counters and peak memory on'
+                             ' stderr at exit')
+    parser.add_argument('--profile', metavar='PROFILE',
+                        help='write cProfile statistics in PROFILE')
+
+
+# Start instrumentation and/or profiling requested by parsed arguments
+def setup(args):
+    if args.instrument:
+        enable()
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        atexit.register(_dump_profile, profiler, args.profile)
+        profiler.enable()
@@ -0,0 +1,304 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+
+import numpy
+import iotracer
+import iotracer_arrays
+import vfs_block_info
+
+
+"""
+    Result of the correlation of VFS and BLK events of a log
+
+    vfs             -- VFS events (IoEventArrays)
+    blk             -- BLK events (IoEventArrays)
+    blk_vfs         -- for each BLK event, index in vfs of the most recent
+                       VFS event it is attributed to (-1 if none)
+    vfs_blk_bytes   -- for each VFS event, number of bytes of the BLK events
+                       attributed to it
+    vfs_blk_events  -- for each VFS event, number of BLK events attributed
+                       to it
+    A BLK read (or direct I/O) is produced by one VFS event: it is only
+    attributed to blk_vfs. A buffered BLK write may flush several VFS writes:
+    it is attributed to each VFS write whose ranges it overlaps, with the
+    overlapping bytes, so several VFS writes of the same blocks may count
+    the same BLK bytes.
+"""
+
+
+class IoCorrelation:
+    _delay_percentiles = [50, 90, 99, 100]
+    
+    def __init__(self, vfs, blk, blk_vfs, vfs_blk_bytes, vfs_blk_events):
+        self.vfs = vfs
+        self.blk = blk
+        self.blk_vfs = blk_vfs
+        self.vfs_blk_bytes = vfs_blk_bytes
+        self.vfs_blk_events = vfs_blk_events
+    
+    # Ratio of bytes read or written at BLK level per byte at VFS level,
+    # for each VFS event
+    def amplification(self):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return self.vfs_blk_bytes / self.vfs.size
+    
+    # Delay between each VFS write and the BLK writes attributed to it
+    def writeback_delays(self):
+        writes = (self.blk_vfs >= 0) & self.blk.write
+        return self.blk.time[writes] - self.vfs.time[self.blk_vfs[writes]]
+    
+    def _type_report(self, name, write):
+        vfs_mask = self.vfs.write == write
+        blk_mask = self.blk.write == write
+        vfs_bytes = int(self.vfs.size[vfs_mask].sum())
+        # BLK events are counted once, even if they overlap several VFS
+        # events
+        attributed = blk_mask & (self.blk_vfs >= 0)
+        blk_bytes = int(self.blk.size[attributed].sum())
+        unattributed = blk_mask & (self.blk_vfs < 0)
+        without_blk = vfs_mask & (self.vfs_blk_events == 0)
+        
+        lines = ["%s: vfs=%s (%s events) blk=%s (%s events)" % (
+                     name, vfs_bytes, int(vfs_mask.sum()), blk_bytes,
+                     int(attributed.sum())),
+                 "%s: amplification=%.4f unattributed_blk=%s (%s events)" % (
+                     name, blk_bytes / vfs_bytes if vfs_bytes else 0.0,
+                     int(self.blk.size[unattributed].sum()),
+                     int(unattributed.sum())),
+                 "%s: without_blk=%s events (%.4f) bytes=%s" % (
+                     name, int(without_blk.sum()),
+                     without_blk.sum() / vfs_mask.sum()
+                     if vfs_mask.any() else 0.0,
+                     int(self.vfs.size[without_blk].sum()))]
+        return lines
+    
+    def __str__(self):
+        # VFS reads without BLK reads are absorbed by the page cache
+        lines = self._type_report("read", False)
+        lines += self._type_report("write", True)
+        delays = self.writeback_delays()
+        if len(delays) > 0:
+            lines.append("writeback delay: %s" % " ".join(
+                "p%s=%.6f" % (p, v) for p, v in zip(
+                    self._delay_percentiles,
+                    numpy.percentile(delays, self._delay_percentiles))))
+        return "\n".join(lines)
+
+
+"""
+    Correlate VFS events with the BLK events they produced
+
+    Expected block ranges of each VFS event are computed from the extents
+    of the file. A BLK event is attributed to the most recent VFS event of
+    the same type whose expected ranges overlap it and which occurred at
+    most window seconds before it; buffered writes are also attributed to
+    the other ones (see IoCorrelation).
+    VFS events are processed by chunks sorted by time. For each chunk, the
+    BLK events of the chunk time window are indexed by start sector, so that
+    candidates of each expected range are found by binary search.
+    Candidate pairs are built by batches of VFS events having about
+    max_pairs candidates, so that blocks rewritten many times within the
+    window do not need memory growing as the product of VFS and BLK events.
+"""
+
+
+class IoCorrelator:
+    def __init__(self, file_extents, window=60.0, directio=False,
+                 chunk_size=65536, max_pairs=1 << 22):
+        self._file_extents = file_extents
+        self._window = window
+        self._directio = directio
+        self._chunk_size = chunk_size
+        self._max_pairs = max_pairs
+    
+    def correlate(self, vfs, blk):
+        vfs = vfs.select(numpy.argsort(vfs.time, kind='stable'))
+        blk = blk.select(numpy.argsort(blk.time, kind='stable'))
+        blk_end = blk.address + (blk.size + 511) // 512
+        
+        best_vfs = numpy.full(len(blk), -1, dtype=numpy.int64)
+        best_time = numpy.full(len(blk), -numpy.inf)
+        vfs_blk_bytes = numpy.zeros(len(vfs))
+        vfs_blk_events = numpy.zeros(len(vfs), dtype=numpy.int64)
+        
+        for start in range(0, len(vfs), self._chunk_size):
+            stop = min(start + self._chunk_size, len(vfs))
+            for (pair_vfs, pair_blk, pair_bytes) in self._chunk_pairs(
+                    vfs, blk, blk_end, start, stop):
+                self._attribute(vfs, blk, pair_vfs, pair_blk, pair_bytes,
+                                best_vfs, best_time, vfs_blk_bytes,
+                                vfs_blk_events)
+        
+        # BLK events attributed to one VFS event only
+        single = best_vfs >= 0
+        if not self._directio:
+            single &= ~blk.write
+        vfs_blk_bytes += numpy.bincount(best_vfs[single],
+                                        weights=blk.size[single],
+                                        minlength=len(vfs))
+        vfs_blk_events += numpy.bincount(best_vfs[single],
+                                         minlength=len(vfs))
+        return IoCorrelation(vfs, blk, best_vfs, vfs_blk_bytes,
+                             vfs_blk_events)
+    
+    # Account a batch of (VFS event, BLK event) pairs
+    def _attribute(self, vfs, blk, pair_vfs, pair_blk, pair_bytes,
+                   best_vfs, best_time, vfs_blk_bytes, vfs_blk_events):
+        if len(pair_vfs) == 0:
+            return
+        
+        if not self._directio:
+            # all pairs of a VFS event are in the same batch, a VFS event
+            # with several ranges overlapping a BLK event counts it once
+            writes = blk.write[pair_blk]
+            vfs_blk_bytes += numpy.bincount(
+                pair_vfs[writes], weights=pair_bytes[writes],
+                minlength=len(vfs))
+            pair_key = numpy.unique(pair_vfs[writes] * len(blk) +
+                                    pair_blk[writes])
+            vfs_blk_events += numpy.bincount(pair_key // len(blk),
+                                             minlength=len(vfs))
+        
+        # keep most recent VFS event of each BLK event
+        pair_time = vfs.time[pair_vfs]
+        order = numpy.lexsort((pair_time, pair_blk))
+        last = numpy.ones(len(order), dtype=bool)
+        last[:-1] = pair_blk[order][1:] != pair_blk[order][:-1]
+        batch_blk = pair_blk[order][last]
+        batch_vfs = pair_vfs[order][last]
+        newer = vfs.time[batch_vfs] >= best_time[batch_blk]
+        best_vfs[batch_blk[newer]] = batch_vfs[newer]
+        best_time[batch_blk[newer]] = vfs.time[batch_vfs[newer]]
+    
+    # Generate batches of (VFS event, BLK event, overlapping bytes) pairs of
+    # a chunk of VFS events
+    def _chunk_pairs(self, vfs, blk, blk_end, start, stop):
+        (range_vfs, range_start,
+         range_size) = self._file_extents.logical_to_block_ranges(
+            vfs.address[start:stop], vfs.size[start:stop], self._directio)
+        range_vfs += start
+        range_end = range_start + (range_size + 511) // 512
+        
+        # BLK events which may be produced by this chunk of VFS events
+        first = numpy.searchsorted(blk.time, vfs.time[start], side='left')
+        last = numpy.searchsorted(blk.time,
+                                  vfs.time[stop - 1] + self._window,
+                                  side='right')
+        if first >= last or len(range_vfs) == 0:
+            return
+        
+        # interval index of BLK events sorted by start sector
+        by_sector = first + numpy.argsort(blk.address[first:last],
+                                          kind='stable')
+        sorted_start = blk.address[by_sector]
+        max_length = int((blk_end[first:last] - blk.address[first:last]).max())
+        
+        # candidates of a range start before its end and less than
+        # max_length sectors before its start
+        lo = numpy.searchsorted(sorted_start, range_start - max_length,
+                                side='right')
+        hi = numpy.searchsorted(sorted_start, range_end, side='left')
+        nb_candidates = numpy.maximum(hi - lo, 0)
+        
+        # ranges of a VFS event are consecutive, batches are split at the
+        # first range of a VFS event every max_pairs candidates
+        before = numpy.cumsum(nb_candidates) - nb_candidates
+        first_range = numpy.flatnonzero(numpy.diff(range_vfs,
+                                                   prepend=-1) != 0)
+        batch = before[first_range] // self._max_pairs
+        edges = first_range[numpy.diff(batch, prepend=-1) != 0]
+        edges = numpy.append(edges, len(range_vfs))
+        for (batch_start, batch_stop) in zip(edges[:-1], edges[1:]):
+            yield self._range_pairs(
+                vfs, blk, blk_end, by_sector, lo[batch_start:batch_stop],
+                nb_candidates[batch_start:batch_stop],
+                range_vfs[batch_start:batch_stop],
+                range_start[batch_start:batch_stop],
+                range_end[batch_start:batch_stop])
+    
+    # Return (VFS event, BLK event, overlapping bytes) pairs of ranges whose
+    # candidates are nb_candidates BLK events of by_sector from lo
+    def _range_pairs(self, vfs, blk, blk_end, by_sector, lo, nb_candidates,
+                     range_vfs, range_start, range_end):
+        pair_range = numpy.repeat(numpy.arange(len(range_vfs)),
+                                  nb_candidates)
+        offset = numpy.arange(len(pair_range)) - numpy.repeat(
+            numpy.cumsum(nb_candidates) - nb_candidates, nb_candidates)
+        pair_blk = by_sector[lo[pair_range] + offset]
+        pair_vfs = range_vfs[pair_range]
+        
+        delay = blk.time[pair_blk] - vfs.time[pair_vfs]
+        match = ((blk_end[pair_blk] > range_start[pair_range]) &
+                 (blk.write[pair_blk] == vfs.write[pair_vfs]) &
+                 (delay >= 0) & (delay <= self._window))
+        (pair_vfs, pair_blk, pair_range) = (
+            pair_vfs[match], pair_blk[match], pair_range[match])
+        # bytes of the BLK event in the range
+        overlap = (numpy.minimum(blk_end[pair_blk], range_end[pair_range]) -
+                   numpy.maximum(blk.address[pair_blk],
+                                 range_start[pair_range]))
+        pair_bytes = numpy.minimum(overlap * 512, blk.size[pair_blk])
+        return pair_vfs, pair_blk, pair_bytes
+
+
+def correlate_log(iotracer_log, file_extents, window, directio):
+    events = iotracer_arrays.load_event_arrays(iotracer_log)
+    correlator = IoCorrelator(file_extents, window, directio)
+    return correlator.correlate(events.at_level(iotracer.IoLevel.VFS),
+                                events.at_level(iotracer.IoLevel.BLK))
+
+
+def print_events(correlation):
+    vfs = correlation.vfs
+    amplification = correlation.amplification()
+    for i in range(len(vfs)):
+        print("%.9f:%s:%s:%s:VFS -> blk=%s (%s events) amplification=%.4f"
+              % (vfs.time[i], 'W' if vfs.write[i] else 'R',
+                 vfs.address[i], vfs.size[i],
+                 int(correlation.vfs_blk_bytes[i]),
+                 correlation.vfs_blk_events[i], amplification[i]))
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iotracerlog', help='file containing iotracer log')
+    parser.add_argument('filefrag',
+                        help='file containing output of command filefrag -v'
+                             ' (monitored file itself with --fiemap)')
+    parser.add_argument('--fiemap', action='store_true',
+                        help='read extents of the file with FIEMAP ioctl')
+    parser.add_argument('--directio', action='store_true',
+                        help='log corresponds to direct I/O access')
+    parser.add_argument('--window', type=float, default=60.0,
+                        help='maximal delay in seconds between a VFS event'
+                             ' and its BLK events (default: %(default)s)')
+    parser.add_argument('--events', action='store_true',
+                        help='display correlation of each VFS event')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    if args.fiemap:
+        prototype = vfs_block_info.FiemapExtentsReader(args.filefrag)
+    else:
+        prototype = vfs_block_info.FilefragOutputParser(args.filefrag)
+    correlation = correlate_log(iotracer.IoTracerLog(args.iotracerlog),
+                                vfs_block_info.FileExtentsList(prototype),
+                                args.window, args.directio)
+    if args.events:
+        print_events(correlation)
+    print(correlation)
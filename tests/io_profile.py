@@ -14,14 +14,25 @@
 
 import sys
 import os
+import io
+import math
+import random
 import subprocess
 import argparse
+import time
 
 from collections import Counter
 from collections import defaultdict
 from collections import OrderedDict
+from statistics import NormalDist
 
+import event_reorder
+import instrumentation
 import iotracer
+import lazy_import
+
+
+process_attribution = lazy_import.lazy_import('process_attribution')
 
 
 # IO statistics
@@ -160,6 +171,75 @@ class IoProfiler:
         else:
             self._iotrace = iotracer_log
     
+    # Return unit of addresses of events of a level
+    @staticmethod
+    def _io_size(level):
+        if level is iotracer.IoLevel.BLK:
+            return 512
+        elif level is iotracer.IoLevel.FS:
+            return 4096
+        elif level is iotracer.IoLevel.VFS:
+            return 1
+    
+    # Count IOs of events of a level
+    # Return (nb_ios, time_tab, size_tab, read_bytes, r_seq, r_rnd,
+    #         write_bytes, w_seq, w_rnd, map_dict)
+    def _count_ios(self, events, level):
+        io_size = self._io_size(level)
+        
+        nb_ios = 0
+        time_tab = []
+        size_tab = []
+        prev_addr = None
+        
+        map_dict = defaultdict(int)
+        
+        w_seq = 0
+        w_rnd = 0
+        r_seq = 0
+        r_rnd = 0
+        read_bytes = 0
+        write_bytes = 0
+        prev_map_addr = None
+        for event in events:
+            # Is it sequential?
+            random_access = False
+            if nb_ios > 0:
+                if event.address != (prev_addr + (size_tab[-1] / io_size)):
+                    random_access = True
+                    map_dict[event.address] = max(
+                        int(event.size / io_size),
+                        map_dict[event.address])
+                    prev_map_addr = event.address
+                else:
+                    map_dict[prev_map_addr] += int(event.size / io_size)
+            else:
+                map_dict.update({event.address: int(event.size / io_size)})
+                prev_map_addr = event.address
+            
+            nb_ios += 1
+            time_tab.append(float(event.time))
+            prev_addr = event.address
+            size_tab.append(event.size)
+            
+            # Calculate the <read/write>_<rand/seq> rates
+            # Is it a write IO?
+            if event.type == 'W':
+                write_bytes += event.size
+                if random_access:
+                    w_rnd += 1
+                else:
+                    w_seq += 1
+            else:
+                read_bytes += event.size
+                if random_access:
+                    r_rnd += 1
+                else:
+                    r_seq += 1
+        
+        return (nb_ios, time_tab, size_tab, read_bytes, r_seq, r_rnd,
+                write_bytes, w_seq, w_rnd, map_dict)
+    
     # Calculate IO statistics for an iotracer log level
     def stats(self, level=iotracer.IoLevel.BLK):
         if not isinstance(level, iotracer.IoLevel):
@@ -167,62 +247,9 @@ class IoProfiler:
         else:
             stats = None
             
-            if level is iotracer.IoLevel.BLK:
-                io_size = 512
-            elif level is iotracer.IoLevel.FS:
-                io_size = 4096
-            elif level is iotracer.IoLevel.VFS:
-                io_size = 1
-            
-            nb_ios = 0
-            time_tab = []
-            size_tab = []
-            prev_addr = None
-            
-            map_dict = defaultdict(int)
-            
-            w_seq = 0
-            w_rnd = 0
-            r_seq = 0
-            r_rnd = 0
-            read_bytes = 0
-            write_bytes = 0
-            prev_map_addr = None
-            for event in self._iotrace.events(level):
-                # Is it sequential?
-                random_access = False
-                if nb_ios > 0:
-                    if event.address != (prev_addr + (size_tab[-1] / io_size)):
-                        random_access = True
-                        map_dict[event.address] = max(
-                            int(event.size / io_size),
-                            map_dict[event.address])
-                        prev_map_addr = event.address
-                    else:
-                        map_dict[prev_map_addr] += int(event.size / io_size)
-                else:
-                    map_dict.update({event.address: int(event.size / io_size)})
-                    prev_map_addr = event.address
-                
-                nb_ios += 1
-                time_tab.append(float(event.time))
-                prev_addr = event.address
-                size_tab.append(event.size)
-                
-                # Calculate the <read/write>_<rand/seq> rates
-                # Is it a write IO?
-                if event.type == 'W':
-                    write_bytes += event.size
-                    if random_access:
-                        w_rnd += 1
-                    else:
-                        w_seq += 1
-                else:
-                    read_bytes += event.size
-                    if random_access:
-                        r_rnd += 1
-                    else:
-                        r_seq += 1
+            (nb_ios, time_tab, size_tab, read_bytes, r_seq, r_rnd,
+             write_bytes, w_seq, w_rnd, map_dict) = self._count_ios(
+                self._iotrace.events(level), level)
             
             if nb_ios > 0:
                 stats = IoTracerStats(nb_ios, time_tab[-1] - time_tab[0],
@@ -280,8 +307,278 @@ class CommandIoProfiler(IoProfiler):
             raise
 
 
+"""
+    IO statistics estimated from a sample of a log (see SampledIoProfiler)
+    Attributes are estimates of IoTracerStats attributes, intervals gives
+    confidence interval (low, high) of each estimate
+        estimates    -- dict of estimates of events, time, read_bytes,
+                        write_bytes and of counts of sequential and random
+                        reads and writes
+        intervals    -- dict of confidence intervals of these estimates
+        size_counter -- Counter of IO sizes of sampled IOs
+        chunks       -- number of chunks read out of total_chunks
+        confidence   -- confidence level of intervals
+"""
+
+
+class SampledIoTracerStats(IoTracerStats):
+    _rate_counts = OrderedDict([("w_seq_rate", "w_seq"),
+                                ("w_rand_rate", "w_rnd"),
+                                ("r_seq_rate", "r_seq"),
+                                ("r_rand_rate", "r_rnd")])
+    
+    def __init__(self, estimates, intervals, size_counter,
+                 chunks, total_chunks, confidence):
+        nb_ios = estimates["events"]
+        exe_t = estimates["time"]
+        (w_seq_rate, w_rand_rate,
+         r_seq_rate, r_rand_rate) = [round(estimates[count], 4)
+                                     for count in self._rate_counts.values()]
+        (dtr, iops) = self._calc_transfer_rates(
+            exe_t, estimates["read_bytes"] + estimates["write_bytes"])
+        
+        IoStats.__init__(self, round(nb_ios), exe_t, dtr, iops,
+                         round(estimates["read_bytes"]),
+                         r_seq_rate, r_rand_rate,
+                         round(estimates["write_bytes"]),
+                         w_seq_rate, w_rand_rate)
+        
+        self.intervals = OrderedDict()
+        for name in ["events", "read_bytes", "write_bytes"]:
+            self.intervals[name] = tuple(round(v) for v in intervals[name])
+        for (rate, count) in self._rate_counts.items():
+            self.intervals[rate] = tuple(round(v, 4)
+                                         for v in intervals[count])
+        # transfer rates are proportional to the number of bytes
+        (low, high) = intervals["bytes"]
+        (dtr_low, iops_low) = self._calc_transfer_rates(exe_t, low)
+        (dtr_high, iops_high) = self._calc_transfer_rates(exe_t, high)
+        self.intervals["dtr"] = (dtr_low, dtr_high)
+        self.intervals["iops"] = (iops_low, iops_high)
+        
+        self.chunks = chunks
+        self.total_chunks = total_chunks
+        self.confidence = confidence
+        self._calc_io_dist(size_counter.elements())
+    
+    def __str__(self):
+        statstr = "\n".join([super().__str__(),
+                             "sample: %s/%s chunks" % (self.chunks,
+                                                       self.total_chunks),
+                             "confidence intervals (%s%%):" %
+                             round(self.confidence * 100, 2)])
+        for (name, (low, high)) in self.intervals.items():
+            statstr = "\n".join([statstr, "%s\t%s\t%s" % (name, low, high)])
+        return statstr
+
+
+"""
+    Estimate IO statistics of an iotracer log file from random chunks of it
+    The file is divided in chunks of chunk_size bytes, a chunk holding the
+    lines starting in it. Chunks are read in random order (sampling without
+    replacement) and IOs of each chunk are counted as IoProfiler does, the
+    first IO of a chunk being sequential. The last chunk, which may be
+    shorter, is always read and counted as is. Totals (events, bytes) of
+    other chunks are estimated from their mean per chunk and rates from
+    ratios of totals, with normal confidence intervals (cluster sampling).
+    time is taken from the first and last chunks.
+    stats() reads chunks until half width of the confidence intervals of
+    events and bytes (relative to their estimate) and of rates (absolute)
+    is below target_error or time_budget seconds have elapsed, at least
+    min_chunks being read. A level without events in these chunks is
+    considered absent. Chunks read are kept for next calls.
+"""
+
+
+class SampledIoProfiler(IoProfiler):
+    def __init__(self, logfile, chunk_size=1 << 20, target_error=0.01,
+                 time_budget=None, confidence=0.95, min_chunks=30,
+                 seed=None):
+        self._logfile = logfile
+        self._chunk_size = chunk_size
+        self.total_chunks = max(1, -(-os.path.getsize(logfile) //
+                                     chunk_size))
+        self.target_error = target_error
+        self.time_budget = time_budget
+        self.confidence = confidence
+        self._z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.min_chunks = min_chunks
+        
+        self._order = list(range(self.total_chunks - 1))
+        random.Random(seed).shuffle(self._order)
+        self._sampled = []
+        self._counts = {}
+    
+    # Return events of the lines starting in a chunk
+    def _read_chunk(self, index):
+        start = index * self._chunk_size
+        with open(self._logfile, 'rb') as logfile:
+            logfile.seek(max(start - 1, 0))
+            data = logfile.read(self._chunk_size + (1 if start > 0 else 0))
+            if start > 0:
+                # skip end of line starting in previous chunk
+                data = data[data.find(b'\n') + 1:] if b'\n' in data else b''
+            if data and not data.endswith(b'\n'):
+                data += logfile.readline()
+        return iotracer.IoTracerLog(io.StringIO(data.decode())).events()
+    
+    # Return dict of counts of IOs of a chunk by level
+    def _chunk_counts(self, index):
+        counts = self._counts.get(index)
+        if counts is None:
+            events = defaultdict(list)
+            for event in self._read_chunk(index):
+                events[event.level].append(event)
+            counts = {}
+            for (level, level_events) in events.items():
+                (nb_ios, time_tab, size_tab, read_bytes, r_seq, r_rnd,
+                 write_bytes, w_seq, w_rnd, _) = self._count_ios(
+                    level_events, level)
+                counts[level] = {"events": nb_ios,
+                                 "read_bytes": read_bytes,
+                                 "write_bytes": write_bytes,
+                                 "bytes": read_bytes + write_bytes,
+                                 "r_seq": r_seq, "r_rnd": r_rnd,
+                                 "w_seq": w_seq, "w_rnd": w_rnd,
+                                 "first_time": time_tab[0],
+                                 "last_time": time_tab[-1],
+                                 "sizes": Counter(size_tab)}
+            self._counts[index] = counts
+        return counts
+    
+    # Return time between first and last IO of a level
+    def _time(self, level):
+        first = self._chunk_counts(0).get(level)
+        last = self._chunk_counts(self.total_chunks - 1).get(level)
+        sampled = [self._counts[i][level]
+                   for i in self._sampled + [self.total_chunks - 1]
+                   if level in self._counts[i]]
+        first_time = (first["first_time"] if first else
+                      min(c["first_time"] for c in sampled))
+        last_time = (last["last_time"] if last else
+                     max(c["last_time"] for c in sampled))
+        return max(last_time - first_time, 0)
+    
+    # Return estimates and confidence intervals of counts of a level
+    # Totals are estimated by counts of the last chunk plus number of other
+    # chunks times mean per sampled chunk and counts of sequential and
+    # random IOs as ratios to the number of events
+    def _estimate(self, level):
+        empty = {"events": 0, "bytes": 0, "read_bytes": 0, "write_bytes": 0,
+                 "r_seq": 0, "r_rnd": 0, "w_seq": 0, "w_rnd": 0}
+        last = self._chunk_counts(self.total_chunks - 1).get(level, empty)
+        chunks = [self._counts[i].get(level, empty) for i in self._sampled]
+        (n, population) = (len(chunks), len(self._order))
+        
+        # half width of interval of the total of values over population
+        def half_width(values):
+            if n == population:
+                return 0
+            if n < 2:
+                return math.inf
+            mean = sum(values) / n
+            variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+            # finite population correction
+            return (self._z * population *
+                    math.sqrt((1 - n / population) * variance / n))
+        
+        def total(values):
+            return sum(values) * population / n if n > 0 else 0
+        
+        (estimates, intervals) = ({}, {})
+        for name in ["events", "bytes", "read_bytes", "write_bytes"]:
+            values = [c[name] for c in chunks]
+            estimate = last[name] + total(values)
+            width = half_width(values)
+            estimates[name] = estimate
+            intervals[name] = (max(estimate - width, 0), estimate + width)
+        
+        events = [c["events"] for c in chunks]
+        for name in ["r_seq", "r_rnd", "w_seq", "w_rnd"]:
+            values = [c[name] for c in chunks]
+            ratio = (last[name] + total(values)) / estimates["events"]
+            width = half_width([v - ratio * e
+                                for (v, e) in zip(values, events)])
+            width /= estimates["events"]
+            estimates[name] = ratio
+            intervals[name] = (max(ratio - width, 0), min(ratio + width, 1))
+        return estimates, intervals
+    
+    # Return largest error of estimates compared to target_error: half
+    # width of intervals relative to the estimate for totals and absolute
+    # for rates
+    @staticmethod
+    def _error(estimates, intervals):
+        errors = [(intervals[name][1] - estimates[name]) / estimates[name]
+                  for name in ["events", "bytes"] if estimates[name] > 0]
+        errors += [max(intervals[name][1] - estimates[name],
+                       estimates[name] - intervals[name][0])
+                   for name in ["r_seq", "r_rnd", "w_seq", "w_rnd"]]
+        return max(errors)
+    
+    # Estimate IO statistics for an iotracer log level
+    def stats(self, level=iotracer.IoLevel.BLK):
+        if not isinstance(level, iotracer.IoLevel):
+            raise TypeError
+        
+        start_time = time.monotonic()
+        self._chunk_counts(self.total_chunks - 1)
+        while True:
+            chunks = self._sampled + [self.total_chunks - 1]
+            nb_events = sum(self._counts[i][level]["events"]
+                            for i in chunks if level in self._counts[i])
+            complete = len(self._sampled) == len(self._order)
+            if len(chunks) >= self.min_chunks or complete:
+                if nb_events == 0:
+                    return None
+                (estimates, intervals) = self._estimate(level)
+                if (complete or
+                        (self.target_error is not None and
+                         self._error(estimates, intervals) <=
+                         self.target_error) or
+                        (self.time_budget is not None and
+                         time.monotonic() - start_time >=
+                         self.time_budget)):
+                    break
+            index = self._order[len(self._sampled)]
+            self._chunk_counts(index)
+            self._sampled.append(index)
+        
+        estimates["time"] = self._time(level)
+        sizes = Counter()
+        for i in chunks:
+            if level in self._counts[i]:
+                sizes.update(self._counts[i][level]["sizes"])
+        return SampledIoTracerStats(estimates, intervals, sizes,
+                                    len(chunks), self.total_chunks,
+                                    self.confidence)
+
+
+# Exit with an error for options of the log command which can not be used
+# together: sampled statistics are computed from chunks of the log file,
+# so they are not reordered and give no per-process breakdown
+def check_log_arguments(parser, args):
+    if args.sample is not None or args.time_budget is not None:
+        for (option, value) in [('--reorder', args.reorder),
+                                ('--processes', args.processes)]:
+            if value:
+                parser.error('%s can not be used with --sample or'
+                             ' --time-budget' % option)
+
+
 def get_log_profile(args):
-    print(IoProfiler(iotracer.IoTracerLog(args.logfile)))
+    check_log_arguments(args.parser, args)
+    iotracer_log = iotracer.IoTracerLog(args.logfile)
+    if args.reorder:
+        iotracer_log = event_reorder.ReorderedLog(iotracer_log, args.reorder)
+    if args.sample is not None or args.time_budget is not None:
+        print(SampledIoProfiler(args.logfile, args.chunk_size, args.sample,
+                                args.time_budget, seed=args.seed))
+    else:
+        print(IoProfiler(iotracer_log))
+    if args.processes:
+        print(process_attribution.attribute_log(iotracer_log).report(
+            args.processes))
 
 
 def get_command_profile(args):
@@ -414,15 +711,39 @@ def check_log_profile(args):
             check_stats(block_stats, expected_stats, allowed_diff)
 
 
-if __name__ == "__main__":
+# Return parser of command line arguments
+def build_parser():
     # create the top-level parser
     parser = argparse.ArgumentParser()
+    instrumentation.add_arguments(parser)
     subparsers = parser.add_subparsers()
     
     # create the parser for the "log" command
     parser_log = subparsers.add_parser('log', help='create from iotracer log')
     parser_log.add_argument('logfile', help='file containing iotracer log')
-    parser_log.set_defaults(func=get_log_profile)
+    parser_log.add_argument('--reorder', type=int, metavar='LOOKAHEAD',
+                            help='put events in timestamp order, holding at'
+                                 ' most LOOKAHEAD events (not with --sample'
+                                 ' or --time-budget)')
+    parser_log.add_argument('--sample', type=float, metavar='ERROR',
+                            help='estimate statistics from random chunks of'
+                                 ' the log until confidence intervals are'
+                                 ' within ERROR (relative for totals,'
+                                 ' absolute for rates)')
+    parser_log.add_argument('--time-budget', type=float, metavar='SECONDS',
+                            help='estimate statistics from random chunks of'
+                                 ' the log read during at most SECONDS per'
+                                 ' level')
+    parser_log.add_argument('--chunk-size', type=int, default=1 << 20,
+                            help='size in bytes of chunks read by --sample'
+                                 ' and --time-budget (default: 1MiB)')
+    parser_log.add_argument('--seed', type=int,
+                            help='seed of the random choice of chunks')
+    parser_log.add_argument('--processes', type=int, metavar='N',
+                            help='display the N processes (tgids and'
+                                 ' commands) doing most I/O at each level'
+                                 ' (not with --sample or --time-budget)')
+    parser_log.set_defaults(func=get_log_profile, parser=parser_log)
     
     # create the parser for the "exec" command
     parser_cmd = subparsers.add_parser(
@@ -442,10 +763,17 @@ if __name__ == "__main__":
                               help='log correspond to direct I/O access')
     parser_check.set_defaults(func=check_log_profile)
     
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    
     # parse argument lists
     args = parser.parse_args()
     
-    if len(vars(args)) > 0:
+    if hasattr(args, 'func'):
+        instrumentation.setup(args)
         # do the work
         args.func(args)
     else:
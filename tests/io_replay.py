@@ -0,0 +1,276 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import mmap
+import os
+import queue
+import threading
+import time
+
+import iotracer
+import iotracer_arrays
+import vfs_block_info
+import fio_iolog
+
+
+"""
+    Latency histogram with power of 2 buckets (in microseconds)
+    Bucket i counts latencies in [2^(i-1), 2^i[ microseconds
+"""
+
+
+class LatencyHistogram:
+    _nb_buckets = 40
+    
+    def __init__(self):
+        self.counts = [0] * self._nb_buckets
+        self.total = 0.0
+    
+    def add(self, latency):
+        usec = max(int(latency * 1e6), 0)
+        self.counts[min(usec.bit_length(), self._nb_buckets - 1)] += 1
+        self.total += latency
+    
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+    
+    def count(self):
+        return sum(self.counts)
+    
+    # Upper bound (in seconds) of the bucket containing percentile p
+    def percentile(self, p):
+        threshold = self.count() * p / 100
+        cumul = 0
+        for bucket, count in enumerate(self.counts):
+            cumul += count
+            if count > 0 and cumul >= threshold:
+                return (1 << bucket) / 1e6
+        return 0.0
+    
+    def __str__(self):
+        lines = []
+        for bucket, count in enumerate(self.counts):
+            if count > 0:
+                lines.append("<%sus\t%s" % (1 << bucket, count))
+        return "\n".join(lines)
+
+
+class ReplayStats:
+    _percentiles = [50, 90, 99, 99.9]
+    
+    def __init__(self):
+        self.read = LatencyHistogram()
+        self.write = LatencyHistogram()
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.skipped = 0
+        self.errors = 0
+        self.elapsed = 0.0
+    
+    def merge(self, other):
+        self.read.merge(other.read)
+        self.write.merge(other.write)
+        self.read_bytes += other.read_bytes
+        self.write_bytes += other.write_bytes
+        self.skipped += other.skipped
+        self.errors += other.errors
+    
+    def iops(self):
+        if self.elapsed > 0:
+            return round((self.read.count() + self.write.count()) /
+                         self.elapsed)
+        return 0
+    
+    def _histogram_str(self, name, histogram, nbytes):
+        if histogram.count() == 0:
+            return "%s: ios=0" % name
+        return "%s: ios=%s bytes=%s mean=%.6f %s" % (
+            name, histogram.count(), nbytes,
+            histogram.total / histogram.count(),
+            " ".join("p%s<%.6f" % (p, histogram.percentile(p))
+                     for p in self._percentiles))
+    
+    def __str__(self):
+        return "\n".join([
+            "time=%.6f iops=%s skipped=%s errors=%s" % (
+                self.elapsed, self.iops(), self.skipped, self.errors),
+            self._histogram_str("read", self.read, self.read_bytes),
+            self._histogram_str("write", self.write, self.write_bytes),
+            "read latency distribution:", "%s" % self.read,
+            "write latency distribution:", "%s" % self.write])
+
+
+"""
+    Replay of an iotracer log on a file or a block device with a pool of
+    threads using os.preadv/os.pwrite on preallocated (page aligned)
+    buffers
+
+    In open-loop mode, each I/O is issued at its recorded time (divided by
+    speed) and latency is measured from this time, so it includes queueing
+    when all threads are busy. In closed-loop mode, I/Os are issued as fast
+    as possible with at most nb_threads I/Os in flight (queue depth).
+    Writes are only executed if allow_write is True, otherwise they are
+    skipped.
+"""
+
+
+class IoReplayer:
+    _queue_size = 65536
+    
+    def __init__(self, target, level=iotracer.IoLevel.VFS, file_extents=None,
+                 nb_threads=4, open_loop=True, speed=1.0,
+                 allow_write=False, direct=False):
+        self._target = target
+        self._level = level
+        self._index = None
+        if file_extents is not None:
+            self._index = vfs_block_info.PhysicalExtentsIndex([file_extents])
+        self._nb_threads = nb_threads
+        self._open_loop = open_loop and speed > 0
+        self._speed = speed
+        self._allow_write = allow_write
+        self._direct = direct
+    
+    # Generate (due time, write, offset, size) of I/Os to replay
+    # due time is None in closed-loop mode
+    def _requests(self, iotracer_log, start):
+        first_time = None
+        for events in iotracer_arrays.iter_event_arrays(iotracer_log,
+                                                        self._level):
+            (offsets, mapped) = fio_iolog.target_offsets(events, self._level,
+                                                         self._index)
+            events = events.select(mapped)
+            if len(events) == 0:
+                continue
+            if first_time is None:
+                first_time = events.time[0]
+            if self._open_loop:
+                due = (start +
+                       (events.time - first_time) / self._speed).tolist()
+            else:
+                due = [None] * len(events)
+            yield from zip(due, events.write.tolist(),
+                           offsets[mapped].tolist(), events.size.tolist())
+    
+    def _worker(self, fd, requests, stats):
+        buf = mmap.mmap(-1, mmap.PAGESIZE)
+        request = requests.get()
+        while request is not None:
+            (due, write, offset, size) = request
+            if write and not self._allow_write:
+                stats.skipped += 1
+                request = requests.get()
+                continue
+            if size > len(buf):
+                buf.close()
+                buf = mmap.mmap(-1, -(-size // mmap.PAGESIZE) *
+                                mmap.PAGESIZE)
+            data = memoryview(buf)[:size]
+            begin = time.monotonic() if due is None else due
+            try:
+                if write:
+                    os.pwrite(fd, data, offset)
+                else:
+                    os.preadv(fd, [data], offset)
+            except OSError:
+                stats.errors += 1
+            else:
+                latency = time.monotonic() - begin
+                if write:
+                    stats.write.add(latency)
+                    stats.write_bytes += size
+                else:
+                    stats.read.add(latency)
+                    stats.read_bytes += size
+            data.release()
+            request = requests.get()
+        buf.close()
+    
+    def replay(self, iotracer_log):
+        flags = os.O_RDWR if self._allow_write else os.O_RDONLY
+        if self._direct:
+            flags |= os.O_DIRECT
+        fd = os.open(self._target, flags)
+        
+        # in closed-loop mode, the bounded queue limits requests read in
+        # advance, threads limit requests in flight
+        requests = queue.Queue(self._queue_size)
+        thread_stats = [ReplayStats() for i in range(self._nb_threads)]
+        threads = [threading.Thread(target=self._worker,
+                                    args=(fd, requests, s))
+                   for s in thread_stats]
+        for thread in threads:
+            thread.start()
+        
+        start = time.monotonic()
+        try:
+            for request in self._requests(iotracer_log, start):
+                due = request[0]
+                if due is not None:
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                requests.put(request)
+        finally:
+            for thread in threads:
+                requests.put(None)
+            for thread in threads:
+                thread.join()
+            os.close(fd)
+        
+        stats = ReplayStats()
+        for s in thread_stats:
+            stats.merge(s)
+        stats.elapsed = time.monotonic() - start
+        return stats
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iotracerlog', help='file containing iotracer log')
+    parser.add_argument('target', help='file or block device to replay on')
+    parser.add_argument('--level', choices=['VFS', 'BLK'], default='VFS',
+                        help='level of events to replay (default: VFS)')
+    parser.add_argument('--filefrag',
+                        help='file containing output of command filefrag -v'
+                             ' for the traced file, used to convert BLK'
+                             ' addresses to offsets in the file')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='number of threads, that is queue depth in'
+                             ' closed-loop mode (default: %(default)s)')
+    parser.add_argument('--closed-loop', action='store_true',
+                        help='replay as fast as possible')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='open-loop replay speed factor'
+                             ' (default: %(default)s)')
+    parser.add_argument('--allow-write', action='store_true',
+                        help='execute writes (destroys target data)')
+    parser.add_argument('--direct', action='store_true',
+                        help='open target with O_DIRECT')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    file_extents = None
+    if args.filefrag:
+        file_extents = vfs_block_info.FileExtentsList(
+            vfs_block_info.FilefragOutputParser(args.filefrag))
+    replayer = IoReplayer(args.target, getattr(iotracer.IoLevel, args.level),
+                          file_extents, args.threads,
+                          open_loop=not args.closed_loop, speed=args.speed,
+                          allow_write=args.allow_write, direct=args.direct)
+    print(replayer.replay(iotracer.IoTracerLog(args.iotracerlog)))
@@ -0,0 +1,401 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import itertools
+
+import numpy
+import iotracer
+
+
+# Level value of events indexed by first character of level name
+_LEVEL_CODES = numpy.zeros(256, dtype=numpy.int8)
+for _level in iotracer.IoLevel:
+    _LEVEL_CODES[ord(_level.name[0])] = _level.value
+
+
+"""
+    IoTracer events stored by columns (numpy arrays)
+    time    -- timestamp in seconds (float64)
+    write   -- True for write access (bool)
+    address -- address of the access (int64), in 512 bytes sectors for BLK
+               events and in bytes for VFS events
+    size    -- size of the access in bytes (int64)
+    level   -- value of the IoLevel of the event (int8)
+    task    -- index of the name of the process in task_names (int32)
+    pid     -- PID of the process (int64)
+"""
+
+
+class IoEventArrays:
+    _columns = ['time', 'write', 'address', 'size', 'level', 'task', 'pid']
+    
+    def __init__(self, time, write, address, size, level, task, pid,
+                 task_names):
+        self.time = time
+        self.write = write
+        self.address = address
+        self.size = size
+        self.level = level
+        self.task = task
+        self.pid = pid
+        self.task_names = task_names
+    
+    def __len__(self):
+        return len(self.time)
+    
+    @classmethod
+    def empty(cls, task_names=None):
+        return cls(numpy.empty(0, dtype=numpy.float64),
+                   numpy.empty(0, dtype=bool),
+                   numpy.empty(0, dtype=numpy.int64),
+                   numpy.empty(0, dtype=numpy.int64),
+                   numpy.empty(0, dtype=numpy.int8),
+                   numpy.empty(0, dtype=numpy.int32),
+                   numpy.empty(0, dtype=numpy.int64),
+                   task_names if task_names is not None else [])
+    
+    # Return events selected by a boolean mask or an index array
+    def select(self, selection):
+        return IoEventArrays(*[getattr(self, name)[selection]
+                               for name in self._columns],
+                             task_names=self.task_names)
+    
+    def at_level(self, level):
+        return self.select(self.level == level.value)
+    
+    @classmethod
+    def concatenate(cls, arrays_list, task_names):
+        if not arrays_list:
+            return cls.empty(task_names)
+        return cls(*[numpy.concatenate([getattr(a, name)
+                                        for a in arrays_list])
+                     for name in cls._columns],
+                   task_names=task_names)
+
+
+"""
+    Convert IoEvent objects to IoEventArrays
+    Task names are interned: the same builder gives the same code to a
+    task name in all the chunks it converts
+"""
+
+
+class IoEventArraysBuilder:
+    def __init__(self):
+        self.task_names = []
+        self._task_codes = {}
+    
+    def _task_code(self, task_name):
+        code = self._task_codes.get(task_name)
+        if code is None:
+            code = len(self.task_names)
+            self._task_codes[task_name] = code
+            self.task_names.append(task_name)
+        return code
+    
+    def build(self, events):
+        count = len(events)
+        return IoEventArrays(
+            numpy.fromiter((float(e.time) for e in events),
+                           dtype=numpy.float64, count=count),
+            numpy.fromiter((e.type == 'W' for e in events),
+                           dtype=bool, count=count),
+            numpy.fromiter((e.address for e in events),
+                           dtype=numpy.int64, count=count),
+            numpy.fromiter((e.size for e in events),
+                           dtype=numpy.int64, count=count),
+            numpy.fromiter((e.level.value for e in events),
+                           dtype=numpy.int8, count=count),
+            numpy.fromiter((self._task_code(e.task_name) for e in events),
+                           dtype=numpy.int32, count=count),
+            numpy.fromiter((e.task_pid for e in events),
+                           dtype=numpy.int64, count=count),
+            self.task_names)
+
+
+# Iterate on events of an IoTracerLog by chunks of IoEventArrays
+def iter_event_arrays(iotracer_log, level=None, chunk_size=65536,
+                      builder=None):
+    if builder is None:
+        builder = IoEventArraysBuilder()
+    events = iotracer_log.events(level)
+    chunk = list(itertools.islice(events, chunk_size))
+    while chunk:
+        yield builder.build(chunk)
+        chunk = list(itertools.islice(events, chunk_size))
+
+
+# Load all events of an IoTracerLog in an IoEventArrays
+def load_event_arrays(iotracer_log, level=None, chunk_size=65536):
+    builder = IoEventArraysBuilder()
+    return IoEventArrays.concatenate(
+        list(iter_event_arrays(iotracer_log, level, chunk_size, builder)),
+        builder.task_names)
+
+
+# Return ASCII digits of non negative integers as a (len(values), width)
+# uint8 matrix (with leading zeros) and the number of significant digits
+# of each value
+def _digits(values, width=None):
+    values = numpy.asarray(values, dtype=numpy.int64)
+    if width is None:
+        width = len(str(int(values.max()))) if len(values) > 0 else 1
+    digits = numpy.empty((len(values), width), dtype=numpy.uint8)
+    nb_digits = numpy.ones(len(values), dtype=numpy.int64)
+    # division by a scalar is much faster than by an array of powers of 10
+    remaining = values
+    for column in range(width - 1, -1, -1):
+        quotient = remaining // 10
+        digits[:, column] = remaining - quotient * 10 + ord('0')
+        remaining = quotient
+        if column > 0:
+            nb_digits += remaining > 0
+    return digits, nb_digits
+
+
+def _variable_field(matrix, length):
+    width = matrix.shape[1]
+    keep = numpy.arange(width) >= (width - length)[:, None]
+    return matrix, keep
+
+
+def _left_aligned_field(matrix, length):
+    keep = numpy.arange(matrix.shape[1]) < length[:, None]
+    return matrix, keep
+
+
+def _constant_field(char, count):
+    return (numpy.full((count, 1), ord(char), dtype=numpy.uint8),
+            numpy.ones((count, 1), dtype=bool))
+
+
+def _string_table(strings):
+    encoded = [s.encode() for s in strings]
+    width = max([len(s) for s in encoded] + [1])
+    table = numpy.zeros((len(encoded), width), dtype=numpy.uint8)
+    for i, s in enumerate(encoded):
+        table[i, :len(s)] = numpy.frombuffer(s, dtype=numpy.uint8)
+    return table, numpy.array([len(s) for s in encoded], dtype=numpy.int64)
+
+
+"""
+    Format events in iotracer log format (as read by IoEvent)
+    All events are formatted at once: fields are written in a byte matrix
+    with one row per event and only significant bytes of each field are kept
+"""
+
+
+def format_events(events):
+    count = len(events)
+    if count == 0:
+        return b''
+    
+    nanoseconds = numpy.round(events.time * 1e9).astype(numpy.int64)
+    (seconds, seconds_len) = _digits(nanoseconds // 10 ** 9)
+    (fraction, _) = _digits(nanoseconds % 10 ** 9, 9)
+    (address, address_len) = _digits(events.address)
+    (size, size_len) = _digits(events.size)
+    (pid, pid_len) = _digits(events.pid)
+    
+    level_names = [''] * (max(level.value for level in iotracer.IoLevel) + 1)
+    for level in iotracer.IoLevel:
+        level_names[level.value] = level.name
+    (level_table, level_len) = _string_table(level_names)
+    (task_table, task_len) = _string_table(events.task_names)
+    
+    io_type = numpy.where(events.write, ord('W'), ord('R'))
+    fields = [_variable_field(seconds, seconds_len),
+              _constant_field('.', count),
+              (fraction, numpy.ones(fraction.shape, dtype=bool)),
+              _constant_field(';', count),
+              (io_type.astype(numpy.uint8)[:, None],
+               numpy.ones((count, 1), dtype=bool)),
+              _constant_field(';', count),
+              _variable_field(address, address_len),
+              _constant_field(';', count),
+              _variable_field(size, size_len),
+              _constant_field(';', count),
+              _left_aligned_field(level_table[events.level],
+                                  level_len[events.level]),
+              _constant_field(';', count),
+              _left_aligned_field(task_table[events.task],
+                                  task_len[events.task]),
+              _constant_field(';', count),
+              _variable_field(pid, pid_len),
+              _constant_field('\n', count)]
+    matrix = numpy.hstack([f[0] for f in fields])
+    keep = numpy.hstack([f[1] for f in fields])
+    return matrix[keep].tobytes()
+
+
+# Write events in a binary file object in iotracer log format
+def write_event_arrays(events, output, chunk_size=1 << 20):
+    for start in range(0, len(events), chunk_size):
+        output.write(format_events(
+            events.select(slice(start, start + chunk_size))))
+
+
+# Return integers written in decimal in fields [start, end) of a uint8 array
+# Digits are accumulated column by column, fields being right aligned on
+# the widest one (positions before the start of a field are masked, the
+# ones wrapping to the end of data for the first line too)
+def _parse_integers(data, start, end):
+    values = numpy.zeros(len(start), dtype=numpy.int64)
+    if len(start) == 0:
+        return values
+    length = end - start
+    for column in range(int(length.max()), 0, -1):
+        position = end - column
+        digit = data[position]
+        digit -= ord('0')
+        if column > length.min():
+            digit *= position >= start
+        values *= 10
+        values += digit
+    return values
+
+
+# Return fields [start, end) of a uint8 array as a (len(start), width)
+# uint8 matrix padded with zeros
+def _parse_strings(data, start, end):
+    width = max(int((end - start).max()) if len(start) > 0 else 0, 1)
+    position = start[:, None] + numpy.arange(width)
+    return numpy.where(position < end[:, None],
+                       data[numpy.minimum(position, len(data) - 1)], 0
+                       ).astype(numpy.uint8)
+
+
+# Return positions of the 6 semicolons of lines [start, newline) of a uint8
+# array and end of their tgid field (before the optional file_id field)
+def _separators(data, start, newline):
+    semicolon = numpy.flatnonzero(data == ord(';'))
+    if len(semicolon) == 6 * len(start):
+        # lines hold their 6 semicolons if none is before the start of its
+        # line or after its end
+        fields = semicolon.reshape(-1, 6)
+        if (fields[:, 0] > start).all() and (fields[:, 5] < newline).all():
+            return tuple(fields.T) + (newline,)
+    
+    first = numpy.searchsorted(semicolon, start)
+    nb_fields = numpy.searchsorted(semicolon, newline) - first + 1
+    if not numpy.isin(nb_fields, (7, 8)).all():
+        raise ValueError('malformed iotracer log line')
+    pid_end = numpy.where(nb_fields == 8,
+                          semicolon[numpy.minimum(first + 6,
+                                                  len(semicolon) - 1)],
+                          newline)
+    return tuple(semicolon[first + i] for i in range(6)) + (pid_end,)
+
+
+"""
+    Parse lines of iotracer log format (as read by IoEvent) at once
+    data must only contain complete lines (the last one may lack its
+    newline). Positions of separators are found for all lines, then each
+    field is converted by _parse_integers for all lines. Task names are
+    interned by builder. The optional file_id field is ignored.
+    If level is specified, fields of lines of other levels are not parsed
+    Raise ValueError on malformed lines
+"""
+
+
+def parse_events(data, builder=None, level=None):
+    if builder is None:
+        builder = IoEventArraysBuilder()
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    if len(data) > 0 and data[-1] != ord('\n'):
+        data = numpy.append(data, numpy.uint8(ord('\n')))
+    newline = numpy.flatnonzero(data == ord('\n'))
+    start = numpy.empty_like(newline)
+    start[:1] = 0
+    start[1:] = newline[:-1] + 1
+    # skip empty lines
+    not_empty = newline > start
+    (start, newline) = (start[not_empty], newline[not_empty])
+    if len(start) == 0:
+        return IoEventArrays.empty(builder.task_names)
+    
+    (s0, s1, s2, s3, s4, s5, pid_end) = _separators(data, start, newline)
+    levels = _LEVEL_CODES[data[s3 + 1]]
+    if not (levels > 0).all():
+        raise ValueError('malformed iotracer log line')
+    if level is not None:
+        selected = levels == level.value
+        (start, s0, s1, s2, s3, s4, s5, pid_end, levels) = [
+            a[selected] for a in (start, s0, s1, s2, s3, s4, s5, pid_end,
+                                  levels)]
+        if len(start) == 0:
+            return IoEventArrays.empty(builder.task_names)
+    
+    # timestamp: seconds.nanoseconds (extra digits are ignored, missing
+    # ones are zeros as in event_reorder.timestamp_ns)
+    dot = s0 - 10
+    if not ((dot >= start) & (data[dot] == ord('.'))).all():
+        dot = numpy.flatnonzero(data == ord('.'))
+        dot = dot[numpy.minimum(numpy.searchsorted(dot, start),
+                                len(dot) - 1)] if len(dot) > 0 else s0
+        dot = numpy.where((dot >= start) & (dot < s0), dot, s0)
+    nsec_end = numpy.minimum(s0, dot + 10)
+    nsec = _parse_integers(data, numpy.minimum(dot + 1, s0), nsec_end)
+    nsec *= 10 ** numpy.maximum(10 - (nsec_end - dot), 0)
+    time = ((_parse_integers(data, start, dot) * 10 ** 9 + nsec)
+            / 10 ** 9)
+    
+    io_type = data[s0 + 1]
+    if not numpy.isin(io_type, (ord('R'), ord('W'))).all():
+        raise ValueError('malformed iotracer log line')
+    
+    # consecutive events are often done by the same task: only names
+    # starting a run of events are interned
+    tasks = _parse_strings(data, s4 + 1, s5)
+    run_start = numpy.ones(len(tasks), dtype=bool)
+    run_start[1:] = (tasks[1:] != tasks[:-1]).any(axis=1)
+    (names, inverse) = numpy.unique(
+        tasks[run_start].view('S%s' % tasks.shape[1]).reshape(-1),
+        return_inverse=True)
+    codes = numpy.array([builder._task_code(name.decode())
+                         for name in names.tolist()], dtype=numpy.int32)
+    codes = codes[inverse.reshape(-1)][numpy.cumsum(run_start) - 1]
+    
+    return IoEventArrays(time, io_type == ord('W'),
+                         _parse_integers(data, s1 + 1, s2),
+                         _parse_integers(data, s2 + 1, s3),
+                         levels,
+                         codes,
+                         _parse_integers(data, s5 + 1, pid_end),
+                         builder.task_names)
+
+
+# Iterate on events of an iotracer log file by chunks of IoEventArrays
+# parsed by parse_events from blocks of about block_size bytes
+def read_event_arrays(path, level=None, block_size=16 << 20, builder=None):
+    if builder is None:
+        builder = IoEventArraysBuilder()
+    with open(path, 'rb') as logfile:
+        remaining = b''
+        while True:
+            block = logfile.read(block_size)
+            if not block:
+                data = remaining
+            else:
+                end = block.rfind(b'\n') + 1
+                if end == 0:
+                    remaining += block
+                    continue
+                data = remaining + block[:end]
+                remaining = block[end:]
+            events = parse_events(data, builder, level)
+            if len(events) > 0:
+                yield events
+            if not block:
+                break
@@ -0,0 +1,306 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import io
+import itertools
+import os
+import tempfile
+import threading
+import time
+
+import iotracer
+import trace_generator
+
+
+"""
+    Log of a simulated monitored inode, with the circular buffer semantics
+    of iotracer_log.c: when the log is full, new events overwrite oldest
+    ones, events are not logged while the log is stopped, reset empties the
+    log and timereset also reinitializes time zero
+    Counters record events injected, overwritten while not read and dropped
+    because the log was stopped
+"""
+
+
+class SimulatedLog:
+    def __init__(self, bdevname, inode, size):
+        self.bdevname = bdevname
+        self.inode = inode
+        self.pathnames = []
+        # logs are created stopped, as by the kernel module
+        self.enabled = 0
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = [None] * size
+        self._next_entry = 0
+        self._nbelems = 0
+        self._time_zero = time.monotonic_ns()
+        self._last_time = self._time_zero
+        self.injected = 0
+        self.overwritten = 0
+        self.dropped = 0
+    
+    def name(self):
+        return '%s_%s' % (self.bdevname, self.inode)
+    
+    # Insert events given as (type, address, size, level name, task name,
+    # tgid) tuples, their timestamps are spread between previous insertion
+    # and now
+    def insert(self, events):
+        nb_events = len(events)
+        if nb_events == 0:
+            return
+        with self._lock:
+            self.injected += nb_events
+            if not self.enabled:
+                self.dropped += nb_events
+                return
+            now = time.monotonic_ns()
+            step = (now - self._last_time) / nb_events
+            timestamps = [self._last_time + int(step * (i + 1))
+                          for i in range(nb_events)]
+            self._last_time = now
+            entries = list(zip(timestamps, events))
+            if nb_events > self.size:
+                # only last size events are kept
+                start = (self._next_entry + nb_events - self.size) % self.size
+                entries = entries[-self.size:]
+            else:
+                start = self._next_entry
+            first_part = min(len(entries), self.size - start)
+            self._entries[start:start + first_part] = entries[:first_part]
+            self._entries[:len(entries) - first_part] = entries[first_part:]
+            
+            self.overwritten += max(self._nbelems + nb_events - self.size, 0)
+            self._nbelems = min(self._nbelems + nb_events, self.size)
+            self._next_entry = (self._next_entry + nb_events) % self.size
+    
+    def command(self, command):
+        with self._lock:
+            if command.startswith('reset'):
+                self._reset()
+            elif command.startswith('timereset'):
+                self._reset()
+                self._time_zero = time.monotonic_ns()
+                self._last_time = self._time_zero
+            elif command.startswith('start'):
+                self.enabled = 1
+            elif command.startswith('stop'):
+                self.enabled = 0
+    
+    def _reset(self):
+        self._entries = [None] * self.size
+        self._next_entry = 0
+        self._nbelems = 0
+    
+    def control_data(self):
+        with self._lock:
+            time_zero = divmod(self._time_zero, 1000000000)
+            return ['%d' % self.enabled, '%d.%09d' % time_zero,
+                    '%d' % self.size, '%d' % self._nbelems]
+    
+    # Return the log file content, oldest event first
+    def content(self):
+        with self._lock:
+            first = self._next_entry + self.size - self._nbelems
+            entries = [self._entries[(first + i) % self.size]
+                       for i in range(self._nbelems)]
+            time_zero = self._time_zero
+        lines = []
+        for (timestamp, event) in entries:
+            (sec, nsec) = divmod(timestamp - time_zero, 1000000000)
+            lines.append('%d.%09d;%s;%d;%d;%s;%s;%d\n' % ((sec, nsec) + event))
+        return ''.join(lines)
+
+
+"""
+    In-process simulation of /proc/iotracer, usable as IoTracer backend
+    on a machine without the kernel module
+    Monitored files must exist, their log is identified by the inode number
+    Events are injected with insert (or an EventInjector)
+"""
+
+
+class SimulatedIoTracerBackend(iotracer.IoTracerBackend):
+    def __init__(self, default_max_events=10, bdevname='sim'):
+        self._default_max_events = default_max_events
+        self._bdevname = bdevname
+        self._logs = {}
+        self._lock = threading.Lock()
+    
+    def is_available(self):
+        return True
+    
+    def monitored(self):
+        with self._lock:
+            return [(log.name(), list(log.pathnames))
+                    for log in self._logs.values()]
+    
+    def log_name(self, filename):
+        return '%s_%s' % (self._bdevname, os.stat(filename).st_ino)
+    
+    def log(self, log_name):
+        return self._logs[log_name]
+    
+    def add(self, filename, max_events=0):
+        log_name = self.log_name(filename)
+        path = os.path.abspath(filename)
+        with self._lock:
+            log = self._logs.get(log_name)
+            if log is None:
+                log = SimulatedLog(self._bdevname, os.stat(filename).st_ino,
+                                   max_events or self._default_max_events)
+                self._logs[log_name] = log
+            if path not in log.pathnames:
+                log.pathnames.append(path)
+    
+    def remove(self, filename):
+        path = os.path.abspath(filename)
+        with self._lock:
+            for (log_name, log) in list(self._logs.items()):
+                if path in log.pathnames:
+                    log.pathnames.remove(path)
+                    if not log.pathnames:
+                        del self._logs[log_name]
+    
+    def command(self, log_name, command):
+        self._logs[log_name].command(command)
+    
+    def control_data(self, log_name):
+        return self._logs[log_name].control_data()
+    
+    def open_log(self, log_name):
+        return io.StringIO(self._logs[log_name].content())
+    
+    # Insert events in a log, they are ignored if the file is not monitored
+    def insert(self, log_name, events):
+        log = self._logs.get(log_name)
+        if log is not None:
+            log.insert(events)
+
+
+"""
+    Thread injecting events in a simulated log at rate events per second
+    during duration seconds (or until stop is called)
+    Events are taken cyclically from a pool generated by TraceGenerator and
+    inserted every tick seconds
+    As the injector runs in the same process as the collector, both share
+    the interpreter lock: rates that can be injected are limited
+"""
+
+
+class EventInjector(threading.Thread):
+    _pool_size = 65536
+    
+    def __init__(self, backend, log_name, rate, duration=None, tick=1e-3,
+                 generator=None):
+        super().__init__(daemon=True)
+        self._backend = backend
+        self._log_name = log_name
+        self._rate = rate
+        self._duration = duration
+        self._tick = tick
+        self._stop_event = threading.Event()
+        if generator is None:
+            generator = trace_generator.TraceGenerator(
+                sizes=(4096, 65536), size_weights=(3, 1), nb_processes=4,
+                blk_sector=2048, seed=0)
+        events = generator.chunk(0, self._pool_size // 2)
+        self._pool = list(zip(
+            ['W' if w else 'R' for w in events.write.tolist()],
+            events.address.tolist(), events.size.tolist(),
+            [iotracer.IoLevel(level).name for level in events.level.tolist()],
+            [events.task_names[task] for task in events.task.tolist()],
+            events.pid.tolist()))
+        self.injected = 0
+    
+    def stop(self):
+        self._stop_event.set()
+    
+    def run(self):
+        pool = itertools.cycle(self._pool)
+        start = time.monotonic()
+        while not self._stop_event.wait(self._tick):
+            elapsed = time.monotonic() - start
+            if self._duration is not None and elapsed >= self._duration:
+                elapsed = self._duration
+                self._stop_event.set()
+            nb_events = int(elapsed * self._rate) - self.injected
+            if nb_events > 0:
+                self._backend.insert(self._log_name,
+                                     list(itertools.islice(pool, nb_events)))
+                self.injected += nb_events
+
+
+# Drain a tracer as collectors do: stop the log, read it, reset and
+# restart it
+# Return number of events read
+def drain(tracer):
+    tracer.stop()
+    nb_events = sum(1 for event in tracer)
+    tracer.reset()
+    tracer.start()
+    return nb_events
+
+
+# Inject events at rate during duration in a simulated log of max_events
+# drained every interval seconds
+# Return (injected, drained, overwritten, dropped) event counts
+def measure_drain(rate, duration, max_events, interval):
+    backend = SimulatedIoTracerBackend()
+    with tempfile.NamedTemporaryFile() as traced_file:
+        tracer = iotracer.IoTracer(traced_file.name, max_events,
+                                   backend=backend)
+        tracer.start()
+        log_name = backend.log_name(traced_file.name)
+        injector = EventInjector(backend, log_name, rate, duration)
+        injector.start()
+        drained = 0
+        while injector.is_alive():
+            time.sleep(interval)
+            drained += drain(tracer)
+        drained += drain(tracer)
+        log = backend.log(log_name)
+        return (log.injected, drained, log.overwritten, log.dropped)
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser(
+        description='measure events/s sustained by the drain of a simulated'
+                    ' iotracer log')
+    parser.add_argument('--rates', type=float, nargs='+',
+                        default=[1e4, 1e5, 3e5, 1e6],
+                        help='injection rates in events/s'
+                             ' (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='injection duration in seconds'
+                             ' (default: %(default)s)')
+    parser.add_argument('--max-events', type=int, default=65536,
+                        help='log size (default: %(default)s)')
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help='drain interval in seconds'
+                             ' (default: %(default)s)')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    print("rate\tinjected\tdrained\toverwritten\tdropped\tlost%")
+    for rate in args.rates:
+        (injected, drained, overwritten, dropped) = measure_drain(
+            rate, args.duration, args.max_events, args.interval)
+        print("%.0f\t%s\t%s\t%s\t%s\t%.2f" % (
+            rate, injected, drained, overwritten, dropped,
+            100 * (injected - drained) / injected if injected else 0.0))
@@ -27,3 +27,32 @@ def clear_cache():
                               shell=True)
     except Exception as err:
         print('Fail to drop clean caches: %s' % (err))
+
+
+def kernel_version():
+    return os.uname().release
+
+
+def iotracer_version():
+    # version of the loaded iotracer kernel module (MODULE_VERSION)
+    try:
+        with open('/sys/module/iotracer/version', 'r') as version_file:
+            return version_file.readline().strip()
+    except OSError:
+        return None
+
+
+# Name of the disk holding a file (as in /sys/block and fio disk_util, the
+# disk of a partition), None if unknown
+def block_device_name(path):
+    try:
+        dev = os.stat(path).st_dev
+        sysfs = os.path.realpath('/sys/dev/block/%s:%s' % (os.major(dev),
+                                                          os.minor(dev)))
+    except OSError:
+        return None
+    if not os.path.isdir(sysfs):
+        return None
+    if os.path.exists(os.path.join(sysfs, 'partition')):
+        sysfs = os.path.dirname(sysfs)
+    return os.path.basename(sysfs)
@@ -0,0 +1,146 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import heapq
+
+from collections import namedtuple
+
+import event_reorder
+import iotracer
+
+# A log to merge: name of the monitored file (or log), IoTracerLog and
+# time zero of the log (second field of its control file)
+log_source = namedtuple('log_source', 'name log time_zero')
+
+
+# Log of an IoTracerBackend, opened again by each iterator as IoTracer does
+class BackendLog(iotracer.IoTracerLog):
+    def __init__(self, backend, log_name):
+        iotracer.IoTracerLog.__init__(self, log_name)
+        self._backend = backend
+    
+    def _open_log(self):
+        return self._backend.open_log(self._log)
+
+
+"""
+    Host-wide timeline of logs of several monitored files
+    Timestamps of a log are relative to its own time zero: they are rebased
+    on the smallest time zero of the logs, then logs are merged with a k-way
+    merge (heapq.merge) which only holds one event per log.
+    Each event gets the index of its log in sources as file_id.
+    Logs must be in timestamp order, if lookahead is set each log is
+    reordered first (see event_reorder.ReorderedLog)
+"""
+
+
+class MergedLog(iotracer.IoTracerLog):
+    def __init__(self, sources, lookahead=0):
+        self.sources = list(sources)
+        self._lookahead = lookahead
+        self._time_zeros = [event_reorder.timestamp_ns(s.time_zero)
+                            for s in self.sources]
+        self.time_zero = min(self._time_zeros, default=0)
+    
+    # Build sources from logs monitored by an IoTracerBackend
+    @classmethod
+    def from_backend(cls, backend, lookahead=0):
+        sources = []
+        for (log_name, paths) in backend.monitored():
+            sources.append(log_source(' '.join(paths),
+                                      BackendLog(backend, log_name),
+                                      backend.control_data(log_name)[1]))
+        return cls(sources, lookahead)
+    
+    # Build sources from log files and their time zeros
+    @classmethod
+    def from_files(cls, files_time_zeros, lookahead=0):
+        sources = []
+        for (path, time_zero) in files_time_zeros:
+            # each iteration reopens the file
+            sources.append(log_source(path, iotracer.IoTracerLog(path),
+                                      time_zero))
+        return cls(sources, lookahead)
+    
+    def __iter__(self):
+        return self.events()
+    
+    # Events of one log as (rebased time, file id, event) tuples
+    # time range is in rebased time, other filters are given to the log
+    def _rebased(self, file_id, level, time_range, filters):
+        log = self.sources[file_id].log
+        if self._lookahead:
+            log = event_reorder.ReorderedLog(log, self._lookahead)
+        offset = self._time_zeros[file_id] - self.time_zero
+        if time_range is not None:
+            filters['time'] = tuple(
+                None if t is None else t - offset / 1e9 for t in time_range)
+        for event in log.events(level, **filters):
+            time = event_reorder.timestamp_ns(event.time) + offset
+            event.time = '%d.%09d' % divmod(time, 1000000000)
+            event.file_id = file_id
+            yield (time, file_id, event)
+    
+    # Merged events, filtered as IoTracerLog.events
+    def events(self, level=None, time=None, **filters):
+        merged = heapq.merge(*[self._rebased(file_id, level, time,
+                                             dict(filters))
+                               for file_id in range(len(self.sources))])
+        return (event for (time, file_id, event) in merged)
+
+
+# Parse "<log file>:<time zero>" argument
+def parse_log_argument(argument):
+    (path, sep, time_zero) = argument.rpartition(':')
+    if not sep:
+        raise argparse.ArgumentTypeError(
+            '%s: time zero of the log is required' % argument)
+    event_reorder.timestamp_ns(time_zero)
+    return (path, time_zero)
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser(
+        description='merge logs of several monitored files in one timeline'
+                    ' whose last field is the id of the file')
+    parser.add_argument('output', help='file where merged log is written')
+    parser.add_argument('logs', nargs='*', type=parse_log_argument,
+                        metavar='LOG:TIME_ZERO',
+                        help='log file and its time zero (second field of'
+                             ' its control file)')
+    parser.add_argument('--proc', action='store_true',
+                        help='merge logs of all files monitored by iotracer'
+                             ' kernel module')
+    parser.add_argument('--lookahead', type=int, default=0,
+                        help='reorder each log holding at most LOOKAHEAD'
+                             ' events (default: logs are in order)')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    if args.proc:
+        merged_log = MergedLog.from_backend(iotracer.ProcIoTracerBackend(),
+                                            args.lookahead)
+    else:
+        merged_log = MergedLog.from_files(args.logs, args.lookahead)
+    with open(args.output, 'w') as output:
+        for event in merged_log:
+            output.write(event_reorder.event_line(event))
+    
+    # print file ids
+    print("file_id\ttime_zero\tfile")
+    for (file_id, source) in enumerate(merged_log.sources):
+        print("%s\t%s\t%s" % (file_id, source.time_zero, source.name))
@@ -0,0 +1,231 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import math
+import time
+
+from collections import namedtuple
+
+import event_reorder
+import iotracer
+
+# State of a log after a poll: rate is the smoothed event rate (events/s)
+# and overflow is True if the log was full
+log_state = namedtuple('log_state',
+                       'filename num_events max_events rate overflow')
+
+
+class _TracerState:
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.max_events = tracer.max_events()
+        self.num_events = tracer.num_events()
+        self.rate = None
+        self.overflow = False
+
+
+"""
+    Controller of the log sizes (max_events) of monitored files
+    Each poll reads num_events and max_events of each log in its control
+    file and updates a smoothed event rate. Logs are then re-registered
+    (IoTracer.resize) with a size holding headroom times the events of one
+    poll interval: hot files get larger logs, cold files smaller ones, and
+    a full log at least doubles. Sizes are scaled down to fit in the global
+    budget of kernel memory (entry_size bytes per event), with at least
+    min_events per log.
+    Resizing drops the events of the log, if drain is set it is called
+    with the IoTracer before each resize and after each poll (then it must
+    read and reset the log, e.g. iotracer_simulator.drain).
+    To avoid resizing at each poll, sizes only change when they are wrong
+    by more than a factor hysteresis, unless the budget is exceeded.
+    Raise ValueError if the budget cannot hold min_events for each log
+"""
+
+
+class MaxEventsController:
+    # sizeof(struct s_iolog_entry) on x86_64
+    entry_size = 56
+    
+    def __init__(self, tracers, budget=64 << 20, interval=1.0, headroom=2.0,
+                 min_events=1024, smoothing=0.5, hysteresis=2.0,
+                 drain=None):
+        self._states = [_TracerState(tracer) for tracer in tracers]
+        self._capacity = budget // self.entry_size
+        if self._capacity < min_events * len(self._states):
+            raise ValueError('budget of %s bytes is too small for %s logs'
+                             ' of %s events' % (budget, len(self._states),
+                                                min_events))
+        self._interval = interval
+        self._headroom = headroom
+        self._min_events = min_events
+        self._smoothing = smoothing
+        self._hysteresis = hysteresis
+        self._drain = drain
+        self._last_poll = time.monotonic()
+        self.resizes = 0
+    
+    def _update_rate(self, state, elapsed):
+        num_events = state.tracer.num_events()
+        if num_events >= state.num_events:
+            new_events = num_events - state.num_events
+        else:
+            # log was reset
+            new_events = num_events
+        state.overflow = num_events >= state.max_events
+        rate = new_events / elapsed
+        if state.rate is None:
+            state.rate = rate
+        else:
+            state.rate += self._smoothing * (rate - state.rate)
+        state.num_events = num_events
+        if self._drain is not None:
+            self._drain(state.tracer)
+            state.num_events = 0
+    
+    def _wanted_size(self, state):
+        wanted = math.ceil(state.rate * self._interval * self._headroom)
+        if state.overflow:
+            wanted = max(wanted, 2 * state.max_events)
+        return max(wanted, self._min_events)
+    
+    # Fit wanted sizes in the budget: each log gets min_events, the
+    # remaining capacity is shared proportionally to the wanted excess
+    def _fit_in_budget(self, wanted):
+        if sum(wanted) <= self._capacity:
+            return wanted
+        excess = [w - self._min_events for w in wanted]
+        available = max(self._capacity - self._min_events * len(wanted), 0)
+        if sum(excess) == 0:
+            return [self._min_events + available // len(wanted)] * len(wanted)
+        return [self._min_events + int(available * e / sum(excess))
+                for e in excess]
+    
+    def _resize(self, state, max_events):
+        if self._drain is not None:
+            self._drain(state.tracer)
+        state.tracer.resize(max_events)
+        state.max_events = max_events
+        state.num_events = 0
+        self.resizes += 1
+    
+    def poll(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_poll, 1e-9)
+        self._last_poll = now
+        for state in self._states:
+            self._update_rate(state, elapsed)
+        
+        sizes = self._fit_in_budget([self._wanted_size(s)
+                                     for s in self._states])
+        changes = [not (s.max_events / self._hysteresis <= size <=
+                        s.max_events * self._hysteresis) or
+                   (s.overflow and size > s.max_events)
+                   for (s, size) in zip(self._states, sizes)]
+        total = sum(size if changed else s.max_events
+                    for (s, size, changed) in zip(self._states, sizes,
+                                                  changes))
+        over_budget = total > self._capacity
+        
+        # shrink logs first so that the budget is never exceeded
+        for (state, size, changed) in sorted(
+                zip(self._states, sizes, changes),
+                key=lambda item: item[1] - item[0].max_events):
+            if size != state.max_events and (
+                    changed or (over_budget and size < state.max_events)):
+                self._resize(state, size)
+        
+        return [log_state(s.tracer.filename(), s.num_events, s.max_events,
+                          s.rate, s.overflow) for s in self._states]
+    
+    def memory(self):
+        return sum(s.max_events for s in self._states) * self.entry_size
+    
+    # Poll every interval seconds during duration seconds (forever if None)
+    # callback is called with result of each poll
+    def run(self, duration=None, callback=None):
+        end = None if duration is None else time.monotonic() + duration
+        while end is None or time.monotonic() < end:
+            time.sleep(self._interval)
+            states = self.poll()
+            if callback is not None:
+                callback(states)
+
+
+# Return a drain function which stops a log, appends its events to output
+# (file object, events are discarded if None), resets and restarts it
+def log_drain(output=None):
+    def drain(tracer):
+        tracer.stop()
+        for event in tracer:
+            if output is not None:
+                output.write(event_reorder.event_line(event))
+        tracer.reset()
+        tracer.start()
+    return drain
+
+
+# Parse a size with an optional K, M or G suffix
+def parse_size(size_str):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    unit = units.get(size_str[-1:].upper())
+    if unit:
+        return int(float(size_str[:-1]) * unit)
+    return int(size_str)
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser(
+        description='adapt log sizes of monitored files to their event rate')
+    parser.add_argument('files', nargs='+', help='files to monitor')
+    parser.add_argument('--budget', type=parse_size, default='64M',
+                        help='kernel memory for all logs'
+                             ' (default: %(default)s)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='poll interval in seconds'
+                             ' (default: %(default)s)')
+    parser.add_argument('--headroom', type=float, default=2.0,
+                        help='log size in number of poll intervals of'
+                             ' events (default: %(default)s)')
+    parser.add_argument('--min-events', type=int, default=1024,
+                        help='minimal log size (default: %(default)s)')
+    parser.add_argument('--duration', type=float,
+                        help='duration in seconds (default: forever)')
+    parser.add_argument('--output',
+                        help='file where events drained from the logs at'
+                             ' each poll are appended (default: discard'
+                             ' them)')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    tracers = [iotracer.IoTracer(f, args.min_events, keep=True)
+               for f in args.files]
+    for tracer in tracers:
+        tracer.start()
+    # logs are drained at each poll, otherwise full logs would look idle
+    output = open(args.output, 'a') if args.output else None
+    controller = MaxEventsController(tracers, args.budget, args.interval,
+                                     args.headroom, args.min_events,
+                                     drain=log_drain(output))
+    
+    def print_states(states):
+        print("file\tnum_events\tmax_events\trate\toverflow")
+        for state in states:
+            print("%s\t%s\t%s\t%.0f\t%s" % state)
+        print("memory=%s resizes=%s" % (controller.memory(),
+                                        controller.resizes))
+    
+    controller.run(args.duration, print_states)
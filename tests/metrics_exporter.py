@@ -0,0 +1,224 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import iotracer
+
+
+# Counters of events of one file at one level for one operation (R or W)
+# Bucket i of size histogram counts events of at most 512 * 2^i bytes
+class IoCounters:
+    nb_buckets = 14
+    bucket_bounds = [512 << i for i in range(nb_buckets)]
+    
+    def __init__(self):
+        self.events = 0
+        self.bytes = 0
+        self.sequential = 0
+        self.buckets = [0] * (self.nb_buckets + 1)
+    
+    def add(self, size, sequential):
+        self.events += 1
+        self.bytes += size
+        if sequential:
+            self.sequential += 1
+        self.buckets[min(max(size - 1, 0).bit_length() - 9,
+                         self.nb_buckets) if size > 512 else 0] += 1
+
+
+def _escape(label_value):
+    return (label_value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+"""
+    Exporter of counters of monitored files in Prometheus text format
+    Logs are drained incrementally (stop, read, reset, start): each event
+    updates the counters of its (file, level, operation) in O(1), events
+    are not stored. The text is rendered after each drain, so scraping
+    does not depend on the number of events.
+    Counters are served over HTTP (/metrics) and/or written to a textfile
+    (for textfile collector of node exporter) after each drain.
+    Logs are started at creation (new logs are stopped) so that events of
+    the first interval are counted.
+"""
+
+
+class MetricsExporter:
+    def __init__(self, tracers, textfile=None):
+        self._tracers = list(tracers)
+        self._textfile = textfile
+        self._counters = {}
+        # next sequential address per (file, level)
+        self._next_address = {}
+        self._drains = 0
+        self._overflows = {tracer.filename(): 0 for tracer in self._tracers}
+        self._lock = threading.Lock()
+        self._text = self._render().encode()
+        for tracer in self._tracers:
+            tracer.start()
+    
+    def _update(self, filename, event):
+        key = (filename, event.level.name, event.type)
+        counters = self._counters.get(key)
+        if counters is None:
+            counters = self._counters[key] = IoCounters()
+        address_key = (filename, event.level)
+        unit = 512 if event.level is iotracer.IoLevel.BLK else 1
+        counters.add(event.size,
+                     self._next_address.get(address_key) == event.address)
+        self._next_address[address_key] = event.address + event.size // unit
+    
+    def drain(self):
+        for tracer in self._tracers:
+            filename = tracer.filename()
+            tracer.stop()
+            if tracer.num_events() >= tracer.max_events():
+                self._overflows[filename] += 1
+            for event in tracer:
+                self._update(filename, event)
+            tracer.reset()
+            tracer.start()
+        self._drains += 1
+        text = self._render().encode()
+        with self._lock:
+            self._text = text
+        if self._textfile:
+            with open(self._textfile + '.tmp', 'wb') as textfile:
+                textfile.write(text)
+            os.rename(self._textfile + '.tmp', self._textfile)
+    
+    def _render(self):
+        lines = []
+        
+        def metric(name, metric_type, help_str, samples):
+            lines.append('# HELP %s %s' % (name, help_str))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            lines.extend(samples)
+        
+        keys = sorted(self._counters)
+        labels = {key: 'file="%s",level="%s",op="%s"' % (
+            _escape(key[0]), key[1], key[2]) for key in keys}
+        metric('iotracer_events_total', 'counter', 'Number of I/O events',
+               ['iotracer_events_total{%s} %s' % (
+                   labels[k], self._counters[k].events) for k in keys])
+        metric('iotracer_bytes_total', 'counter', 'Bytes accessed',
+               ['iotracer_bytes_total{%s} %s' % (
+                   labels[k], self._counters[k].bytes) for k in keys])
+        metric('iotracer_sequential_events_total', 'counter',
+               'Number of I/O events following the previous one',
+               ['iotracer_sequential_events_total{%s} %s' % (
+                   labels[k], self._counters[k].sequential) for k in keys])
+        
+        samples = []
+        for key in keys:
+            counters = self._counters[key]
+            cumul = 0
+            for (bound, count) in zip(IoCounters.bucket_bounds,
+                                      counters.buckets):
+                cumul += count
+                samples.append('iotracer_io_size_bytes_bucket{%s,le="%s"} %s'
+                               % (labels[key], bound, cumul))
+            samples.append('iotracer_io_size_bytes_bucket{%s,le="+Inf"} %s'
+                           % (labels[key], counters.events))
+            samples.append('iotracer_io_size_bytes_sum{%s} %s'
+                           % (labels[key], counters.bytes))
+            samples.append('iotracer_io_size_bytes_count{%s} %s'
+                           % (labels[key], counters.events))
+        metric('iotracer_io_size_bytes', 'histogram', 'Size of I/O events',
+               samples)
+        
+        metric('iotracer_log_overflows_total', 'counter',
+               'Number of drains finding a full log (events lost)',
+               ['iotracer_log_overflows_total{file="%s"} %s' % (
+                   _escape(f), n) for (f, n) in sorted(
+                       self._overflows.items())])
+        metric('iotracer_drains_total', 'counter', 'Number of drains',
+               ['iotracer_drains_total %s' % self._drains])
+        return '\n'.join(lines) + '\n'
+    
+    # Return text of last drain
+    def text(self):
+        with self._lock:
+            return self._text
+    
+    # Drain every interval seconds during duration seconds (forever if None)
+    def run(self, interval=1.0, duration=None):
+        end = None if duration is None else time.monotonic() + duration
+        while end is None or time.monotonic() < end:
+            time.sleep(interval)
+            self.drain()
+    
+    # Serve /metrics on address (host, port) in a background thread
+    # Return the HTTP server
+    def serve(self, address=('localhost', 9741)):
+        exporter = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                text = exporter.text()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        server = ThreadingHTTPServer(address, MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser(
+        description='export I/O counters of monitored files in Prometheus'
+                    ' text format')
+    parser.add_argument('files', nargs='+', help='files to monitor')
+    parser.add_argument('--port', type=int, default=9741,
+                        help='HTTP port of /metrics, 0 to disable'
+                             ' (default: %(default)s)')
+    parser.add_argument('--bind', default='localhost',
+                        help='HTTP address (default: %(default)s)')
+    parser.add_argument('--textfile',
+                        help='file written after each drain')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='drain interval in seconds'
+                             ' (default: %(default)s)')
+    parser.add_argument('--max-events', type=int, default=65536,
+                        help='log size of monitored files'
+                             ' (default: %(default)s)')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    tracers = [iotracer.IoTracer(f, args.max_events, keep=True)
+               for f in args.files]
+    exporter = MetricsExporter(tracers, args.textfile)
+    if args.port:
+        exporter.serve((args.bind, args.port))
+    exporter.run(args.interval)
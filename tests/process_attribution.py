@@ -0,0 +1,246 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+
+import numpy
+import iotracer
+import iotracer_arrays
+
+
+# Unit of addresses of each level (see IoProfiler.stats), indexed by level
+# value
+_ADDRESS_UNIT = numpy.array([1, 512, 4096, 1], dtype=numpy.int64)
+_NB_LEVELS = len(_ADDRESS_UNIT)
+
+# Columns of the report and the counter used to sort by each of them
+_SORT_KEYS = ['bytes', 'iops', 'random']
+
+
+"""
+    Counters of events of groups of processes (tgids or commands) at each
+    level, stored in (nb_groups, levels) arrays indexed by a group code and
+    the value of the level
+    An event is random when its address does not follow the end of the
+    previous event of the same group at the same level, as IoProfiler does
+    for the whole log
+"""
+
+
+class GroupCounters:
+    _counters = ['events', 'read_bytes', 'write_bytes', 'random']
+    
+    def __init__(self):
+        self.events = numpy.zeros((0, _NB_LEVELS), dtype=numpy.int64)
+        self.read_bytes = numpy.zeros((0, _NB_LEVELS), dtype=numpy.int64)
+        self.write_bytes = numpy.zeros((0, _NB_LEVELS), dtype=numpy.int64)
+        self.random = numpy.zeros((0, _NB_LEVELS), dtype=numpy.int64)
+        # end address of the last event of each group (-1 if none)
+        self._last_end = numpy.zeros((0, _NB_LEVELS), dtype=numpy.int64)
+    
+    def __len__(self):
+        return len(self.events)
+    
+    def _grow(self, nb_groups):
+        if nb_groups <= len(self):
+            return
+        extra = nb_groups - len(self)
+        for name in self._counters:
+            setattr(self, name,
+                    numpy.concatenate([getattr(self, name),
+                                       numpy.zeros((extra, _NB_LEVELS),
+                                                   dtype=numpy.int64)]))
+        self._last_end = numpy.concatenate(
+            [self._last_end, numpy.full((extra, _NB_LEVELS), -1,
+                                        dtype=numpy.int64)])
+    
+    # Account a chunk of events (IoEventArrays) whose group codes are codes
+    def update(self, events, codes, nb_groups):
+        self._grow(nb_groups)
+        slot = codes.astype(numpy.int64) * _NB_LEVELS + events.level
+        size = nb_groups * _NB_LEVELS
+        
+        self.events += numpy.bincount(
+            slot, minlength=size).reshape(-1, _NB_LEVELS)
+        for write, counter in [(False, self.read_bytes),
+                               (True, self.write_bytes)]:
+            mask = events.write == write
+            counter += numpy.bincount(
+                slot[mask], weights=events.size[mask],
+                minlength=size).astype(numpy.int64).reshape(-1, _NB_LEVELS)
+        
+        # compare each event with the previous one of its slot: events are
+        # sorted by slot (stable sort keeps time order in each slot) and the
+        # first event of a slot is compared with the last one of the
+        # previous chunks
+        order = numpy.argsort(slot, kind='stable')
+        slot = slot[order]
+        address = events.address[order]
+        unit = _ADDRESS_UNIT[events.level[order]]
+        end = address + events.size[order] // unit
+        first = numpy.ones(len(slot), dtype=bool)
+        first[1:] = slot[1:] != slot[:-1]
+        last_end = self._last_end.reshape(-1)
+        previous = numpy.empty_like(end)
+        previous[1:] = end[:-1]
+        previous[first] = last_end[slot[first]]
+        random = (previous >= 0) & (address != previous)
+        self.random += numpy.bincount(
+            slot[random], minlength=size).reshape(-1, _NB_LEVELS)
+        last = numpy.ones(len(slot), dtype=bool)
+        last[:-1] = first[1:]
+        last_end[slot[last]] = end[last]
+
+
+"""
+    Per-process breakdown of the events of an iotracer log
+    Events are counted by tgid and by command (task name) at each level in
+    one pass over the log, by chunks of IoEventArrays. Tgids are interned
+    like task names are by IoEventArraysBuilder.
+"""
+
+
+class ProcessAttribution:
+    def __init__(self):
+        self._builder = iotracer_arrays.IoEventArraysBuilder()
+        self.tgids = []
+        self._tgid_codes = {}
+        # code of the last command of each tgid
+        self._tgid_task = numpy.zeros(0, dtype=numpy.int32)
+        self.by_tgid = GroupCounters()
+        self.by_task = GroupCounters()
+        self._first_time = numpy.full(_NB_LEVELS, numpy.inf)
+        self._last_time = numpy.full(_NB_LEVELS, -numpy.inf)
+    
+    @property
+    def task_names(self):
+        return self._builder.task_names
+    
+    # Return interned codes of the tgids of a chunk of events
+    def _tgid_code(self, pid):
+        (values, inverse) = numpy.unique(pid, return_inverse=True)
+        codes = numpy.empty(len(values), dtype=numpy.int32)
+        for i, tgid in enumerate(values.tolist()):
+            code = self._tgid_codes.get(tgid)
+            if code is None:
+                code = len(self.tgids)
+                self._tgid_codes[tgid] = code
+                self.tgids.append(tgid)
+            codes[i] = code
+        return codes[inverse.reshape(-1)]
+    
+    # Account a chunk of events (IoEventArrays)
+    def update(self, events):
+        if len(events) == 0:
+            return
+        tgid = self._tgid_code(events.pid)
+        self.by_tgid.update(events, tgid, len(self.tgids))
+        self.by_task.update(events, events.task, len(self.task_names))
+        
+        if len(self._tgid_task) < len(self.tgids):
+            self._tgid_task = numpy.concatenate([
+                self._tgid_task,
+                numpy.zeros(len(self.tgids) - len(self._tgid_task),
+                            dtype=numpy.int32)])
+        self._tgid_task[tgid] = events.task
+        
+        numpy.minimum.at(self._first_time, events.level, events.time)
+        numpy.maximum.at(self._last_time, events.level, events.time)
+    
+    # Account the events of an IoTracerLog
+    def update_from_log(self, iotracer_log, chunk_size=65536):
+        for events in iotracer_arrays.iter_event_arrays(
+                iotracer_log, chunk_size=chunk_size, builder=self._builder):
+            self.update(events)
+        return self
+    
+    def duration(self, level):
+        return max(0.0, self._last_time[level.value] -
+                   self._first_time[level.value])
+    
+    def _names(self, by):
+        if by == 'tgid':
+            return ['%s (%s)' % (tgid, self.task_names[task])
+                    for (tgid, task) in zip(self.tgids, self._tgid_task)]
+        return list(self.task_names)
+    
+    # Return the top n groups (by 'tgid' or 'task') at a level, sorted by
+    # one of the _SORT_KEYS, as a list of tuples
+    # (name, events, read_bytes, write_bytes, iops, random_ratio)
+    # iops are events per second over the duration of the level
+    def top(self, level, by='tgid', n=10, sort='bytes'):
+        counters = self.by_tgid if by == 'tgid' else self.by_task
+        if sort not in _SORT_KEYS:
+            raise ValueError('unknown sort key %s' % sort)
+        if len(counters) == 0:
+            return []
+        
+        events = counters.events[:, level.value]
+        read_bytes = counters.read_bytes[:, level.value]
+        write_bytes = counters.write_bytes[:, level.value]
+        duration = self.duration(level)
+        iops = events / duration if duration > 0 else numpy.zeros(len(events))
+        random = counters.random[:, level.value] / numpy.maximum(events, 1)
+        
+        key = {'bytes': read_bytes + write_bytes,
+               'iops': events,
+               'random': random}[sort]
+        groups = numpy.flatnonzero(events)
+        groups = groups[numpy.argsort(-key[groups], kind='stable')][:n]
+        names = self._names(by)
+        return [(names[i], int(events[i]), int(read_bytes[i]),
+                 int(write_bytes[i]), float(iops[i]), float(random[i]))
+                for i in groups]
+    
+    def report(self, n=10, sort='bytes', by=('tgid', 'task')):
+        lines = []
+        for level in iotracer.IoLevel:
+            if not self.by_task.events[:, level.value].any():
+                continue
+            for group in by:
+                lines.append("---- %s by %s ----" % (level.name, group))
+                lines.append("\t".join([group, "events", "read_bytes",
+                                        "write_bytes", "iops", "random"]))
+                for (name, events, read_bytes, write_bytes,
+                     iops, random) in self.top(level, group, n, sort):
+                    lines.append("%s\t%s\t%s\t%s\t%.1f\t%.4f" % (
+                        name, events, read_bytes, write_bytes, iops, random))
+        return "\n".join(lines)
+    
+    def __str__(self):
+        return self.report()
+
+
+# Return per-process breakdown of the events of an IoTracerLog
+def attribute_log(iotracer_log, chunk_size=65536):
+    return ProcessAttribution().update_from_log(iotracer_log, chunk_size)
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iotracerlog', help='file containing iotracer log')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of processes displayed per level')
+    parser.add_argument('--sort', choices=_SORT_KEYS, default='bytes',
+                        help='sort processes by bytes, iops or random ratio')
+    parser.add_argument('--by', choices=['tgid', 'task'], action='append',
+                        help='group by tgid and/or command (default: both)')
+
+    # parse argument lists
+    args = parser.parse_args()
+
+    attribution = attribute_log(iotracer.IoTracerLog(args.iotracerlog))
+    print(attribution.report(args.top, args.sort,
+                             args.by if args.by else ('tgid', 'task')))
@@ -0,0 +1,230 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import multiprocessing
+
+import numpy
+import iotracer
+import iotracer_arrays
+
+
+"""
+    Generator of synthetic iotracer logs
+
+    nb_processes processes access a file of file_size bytes. Each event is
+    done by a random process; it is sequential (follows previous access of
+    the same process) with probability seq_ratio and is a read with
+    probability read_ratio. Sizes are drawn from sizes with weights
+    size_weights. Events are separated by interval seconds in average.
+    With blk_sector >= 0, each VFS event produces a BLK event blk_delay
+    seconds later, the file being stored contiguously from sector
+    blk_sector.
+    Events are generated by chunks of chunk_size events, all events of a
+    chunk at once. Chunk number i covers the time range starting at
+    i * chunk_size * interval and lasting count * interval, its VFS
+    timestamps are uniformly spread in it (minus blk_delay at the end, so
+    that BLK events stay in it) and events of a chunk are sorted by time:
+    without jitter, timestamps of the log are in order. jitter adds a
+    uniform noise of +/- jitter seconds to timestamps (so they may be out
+    of order).
+"""
+
+
+class TraceGenerator:
+    def __init__(self, file_size=1 << 30, seq_ratio=0.5, read_ratio=0.5,
+                 sizes=(4096,), size_weights=None, nb_processes=1,
+                 interval=1e-4, jitter=0.0, blk_sector=-1, blk_delay=1e-5,
+                 seed=None, chunk_size=1 << 20):
+        self._file_size = file_size
+        self._seq_ratio = seq_ratio
+        self._read_ratio = read_ratio
+        self._sizes = numpy.asarray(sizes, dtype=numpy.int64)
+        if size_weights is None:
+            size_weights = numpy.ones(len(sizes))
+        self._size_weights = (numpy.asarray(size_weights, dtype=float) /
+                              numpy.sum(size_weights))
+        self._nb_processes = nb_processes
+        self._interval = interval
+        self._jitter = jitter
+        self._blk_sector = blk_sector
+        self._blk_delay = blk_delay
+        self._chunk_size = chunk_size
+        if seed is None:
+            seed = numpy.random.SeedSequence().entropy
+        self._seed = seed
+        
+        self.task_names = ['proc%s' % i for i in range(nb_processes)]
+        self._pids = 1000 + numpy.arange(nb_processes, dtype=numpy.int64)
+    
+    def _addresses(self, rnd, process, size):
+        count = len(process)
+        max_size = int(self._sizes.max())
+        random_access = rnd.random(count) >= self._seq_ratio
+        random_address = (rnd.integers(0, max(self._file_size - max_size, 1),
+                                       count) // 512) * 512
+        
+        # group events by process, keeping their order
+        order = numpy.argsort(process, kind='stable')
+        sorted_process = process[order]
+        sorted_size = size[order]
+        first = numpy.ones(count, dtype=bool)
+        first[1:] = sorted_process[1:] != sorted_process[:-1]
+        
+        # a run of sequential accesses starts at each random access and at
+        # first access of each process in the chunk
+        run_start = random_access[order] | first
+        run_start_address = random_address[order]
+        run_id = numpy.cumsum(run_start) - 1
+        cumsize = numpy.cumsum(sorted_size) - sorted_size
+        start_index = numpy.flatnonzero(run_start)
+        address = (run_start_address[start_index][run_id] +
+                   cumsize - cumsize[start_index][run_id])
+        # sequential runs wrap at end of file
+        address %= max(self._file_size - max_size, 1)
+        
+        result = numpy.empty(count, dtype=numpy.int64)
+        result[order] = address
+        return result
+    
+    # Sorted timestamps of count VFS events of chunk number index: the gaps
+    # between events are exponential, normalized so that events stay in the
+    # time range of the chunk
+    def _times(self, rnd, index, count):
+        start_time = index * self._chunk_size * self._interval
+        duration = count * self._interval
+        if self._blk_sector >= 0:
+            duration = max(duration - self._blk_delay, 0.0)
+        gaps = rnd.exponential(1.0, count + 1)
+        return start_time + duration * numpy.cumsum(gaps[:-1]) / gaps.sum()
+    
+    def _vfs_chunk(self, rnd, index, count):
+        process = rnd.integers(0, self._nb_processes, count)
+        size = self._sizes[rnd.choice(len(self._sizes), count,
+                                      p=self._size_weights)]
+        return iotracer_arrays.IoEventArrays(
+            self._times(rnd, index, count), rnd.random(count) >= self._read_ratio,
+            self._addresses(rnd, process, size), size,
+            numpy.full(count, iotracer.IoLevel.VFS.value, dtype=numpy.int8),
+            process.astype(numpy.int32), self._pids[process],
+            self.task_names)
+    
+    # BLK events produced by VFS events, merged with them in time order (a
+    # VFS event comes before a BLK event of the same time)
+    def _with_blk_events(self, vfs):
+        blk = vfs.select(slice(None))
+        blk.time = vfs.time + self._blk_delay
+        first_sector = vfs.address // 512
+        last_sector = (vfs.address + vfs.size - 1) // 512
+        blk.address = self._blk_sector + first_sector
+        blk.size = (last_sector - first_sector + 1) * 512
+        blk.level = numpy.full(len(vfs), iotracer.IoLevel.BLK.value,
+                               dtype=numpy.int8)
+        
+        both = iotracer_arrays.IoEventArrays.concatenate([vfs, blk],
+                                                         self.task_names)
+        return both.select(numpy.argsort(both.time, kind='stable'))
+    
+    # Generate chunk number index of count VFS events (and BLK events)
+    def chunk(self, index, count=None):
+        rnd = numpy.random.default_rng([self._seed, index])
+        events = self._vfs_chunk(rnd, index, count or self._chunk_size)
+        if self._blk_sector >= 0:
+            events = self._with_blk_events(events)
+        if self._jitter > 0:
+            events.time = numpy.maximum(
+                events.time + rnd.uniform(-self._jitter, self._jitter,
+                                          len(events)), 0.0)
+        return events
+    
+    def _chunk_counts(self, nb_events):
+        for index, start in enumerate(range(0, nb_events, self._chunk_size)):
+            yield index, min(self._chunk_size, nb_events - start)
+    
+    # Generate nb_events VFS events (and their BLK events) by chunks
+    def chunks(self, nb_events):
+        for index, count in self._chunk_counts(nb_events):
+            yield self.chunk(index, count)
+    
+    def _formatted_chunk(self, index_count):
+        return iotracer_arrays.format_events(self.chunk(*index_count))
+    
+    # Write log of nb_events VFS events, chunks are generated and formatted
+    # by nb_jobs processes
+    # Each process writes about 1M log lines (events) per second, so large
+    # logs need one job per CPU
+    def write(self, nb_events, output, nb_jobs=1):
+        if nb_jobs > 1:
+            with multiprocessing.Pool(nb_jobs) as pool:
+                for data in pool.imap(self._formatted_chunk,
+                                      self._chunk_counts(nb_events)):
+                    output.write(data)
+        else:
+            for index_count in self._chunk_counts(nb_events):
+                output.write(self._formatted_chunk(index_count))
+
+
+def parse_sizes(sizes_str):
+    sizes = []
+    weights = []
+    for item in sizes_str.split(','):
+        (size, _, weight) = item.partition(':')
+        sizes.append(int(size))
+        weights.append(float(weight) if weight else 1.0)
+    return sizes, weights
+
+
+if __name__ == "__main__":
+    # create the argument's parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help='iotracer log file to create')
+    parser.add_argument('events', type=int, help='number of VFS events')
+    parser.add_argument('--file-size', type=int, default=1 << 30,
+                        help='size of accessed file (default: %(default)s)')
+    parser.add_argument('--seq-ratio', type=float, default=0.5,
+                        help='ratio of sequential accesses'
+                             ' (default: %(default)s)')
+    parser.add_argument('--read-ratio', type=float, default=0.5,
+                        help='ratio of reads (default: %(default)s)')
+    parser.add_argument('--sizes', default='4096',
+                        help='access sizes with optional weights, as in'
+                             ' 4096:0.7,65536:0.3 (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes (default: %(default)s)')
+    parser.add_argument('--interval', type=float, default=1e-4,
+                        help='mean time between events in seconds'
+                             ' (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='timestamp jitter in seconds'
+                             ' (default: %(default)s)')
+    parser.add_argument('--blk-sector', type=int, default=-1,
+                        help='generate BLK events, file starting at this'
+                             ' sector')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of generating processes (default:'
+                             ' number of CPUs, each one writing about 1M'
+                             ' events per second)')
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    (sizes, weights) = parse_sizes(args.sizes)
+    generator = TraceGenerator(args.file_size, args.seq_ratio,
+                               args.read_ratio, sizes, weights,
+                               args.processes, args.interval, args.jitter,
+                               args.blk_sector, seed=args.seed)
+    with open(args.output, 'wb') as output:
+        generator.write(args.events, output, args.jobs)
@@ -0,0 +1,326 @@
+# !/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright 2015-2016 b<>com
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import argparse
+import itertools
+import sqlite3
+import time
+
+import numpy
+
+import event_reorder
+import iotracer
+import iotracer_arrays
+
+
+"""
+    Store of iotracer logs in a SQLite database
+    Events are bulk loaded with executemany in large transactions (WAL
+    journal), timestamps are stored in nanoseconds. Indexes on time,
+    (level, address) and (tgid, time) are created after loading, so that
+    queries on a time range, an address range or a process do not scan
+    all events.
+    An event covers addresses [address, end_address[ (sectors for BLK
+    events, bytes for VFS events). To find events overlapping an address
+    range with the (level, address) index, the greatest end_address -
+    address of each level is kept in table level_span.
+"""
+
+
+class TraceStore:
+    _schema = [
+        """CREATE TABLE IF NOT EXISTS trace (
+               trace_id INTEGER PRIMARY KEY,
+               name TEXT NOT NULL,
+               time_zero TEXT,
+               date REAL NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS task (
+               task_id INTEGER PRIMARY KEY,
+               name TEXT NOT NULL UNIQUE)""",
+        """CREATE TABLE IF NOT EXISTS event (
+               trace_id INTEGER NOT NULL REFERENCES trace(trace_id),
+               time INTEGER NOT NULL,
+               write INTEGER NOT NULL,
+               address INTEGER NOT NULL,
+               end_address INTEGER NOT NULL,
+               size INTEGER NOT NULL,
+               level INTEGER NOT NULL,
+               task_id INTEGER NOT NULL REFERENCES task(task_id),
+               tgid INTEGER NOT NULL,
+               file_id INTEGER)""",
+        """CREATE TABLE IF NOT EXISTS level_span (
+               level INTEGER PRIMARY KEY,
+               max_span INTEGER NOT NULL)""",
+    ]
+    _indexes = [
+        "CREATE INDEX IF NOT EXISTS event_time ON event(time)",
+        """CREATE INDEX IF NOT EXISTS event_level_address
+               ON event(level, address)""",
+        "CREATE INDEX IF NOT EXISTS event_tgid ON event(tgid, time)",
+    ]
+    _columns = ("e.time, e.write, e.address, e.size, e.level, e.task_id,"
+                " e.tgid")
+    
+    def __init__(self, path, batch_size=200000):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._batch_size = batch_size
+        with self._db:
+            for statement in self._schema:
+                self._db.execute(statement)
+        self._tasks = dict(self._db.execute("SELECT name, task_id FROM task"))
+    
+    def close(self):
+        self._db.close()
+    
+    def __del__(self):
+        self._db.close()
+    
+    def _task_id(self, name):
+        task_id = self._tasks.get(name)
+        if task_id is None:
+            task_id = self._db.execute("INSERT INTO task (name) VALUES (?)",
+                                       (name,)).lastrowid
+            self._tasks[name] = task_id
+        return task_id
+    
+    def _rows(self, trace_id, events, spans):
+        for event in events:
+            unit = 512 if event.level is iotracer.IoLevel.BLK else 1
+            span = max(-(-event.size // unit), 1)
+            level = event.level.value
+            if span > spans.get(level, 0):
+                spans[level] = span
+            yield (trace_id, event_reorder.timestamp_ns(event.time),
+                   event.type == 'W', event.address, event.address + span,
+                   event.size, level, self._task_id(event.task_name),
+                   event.task_pid, event.file_id)
+    
+    # Load all events of an IoTracerLog, indexes are (re)created at the end
+    # Return (trace id, number of events)
+    def import_log(self, iotracer_log, name, time_zero=None):
+        with self._db:
+            trace_id = self._db.execute(
+                "INSERT INTO trace (name, time_zero, date) VALUES (?, ?, ?)",
+                (name, time_zero, time.time())).lastrowid
+        spans = {}
+        rows = self._rows(trace_id, iter(iotracer_log), spans)
+        nb_events = 0
+        batch = list(itertools.islice(rows, self._batch_size))
+        while batch:
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO event VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    batch)
+            nb_events += len(batch)
+            batch = list(itertools.islice(rows, self._batch_size))
+        with self._db:
+            for (level, span) in spans.items():
+                self._db.execute(
+                    "INSERT INTO level_span VALUES (?, ?) ON CONFLICT(level)"
+                    " DO UPDATE SET max_span = max(max_span, excluded.max_span)",
+                    (level, span))
+            for statement in self._indexes:
+                self._db.execute(statement)
+            self._db.execute("ANALYZE")
+        return (trace_id, nb_events)
+    
+    def traces(self):
+        return self._db.execute(
+            "SELECT t.trace_id, t.name, t.time_zero, count(e.trace_id)"
+            " FROM trace t LEFT JOIN event e ON e.trace_id = t.trace_id"
+            " GROUP BY t.trace_id ORDER BY t.trace_id").fetchall()
+    
+    # Build WHERE clause and parameters of a query and return them with the
+    # expression of time used to sort events
+    # time and address are (first, last) ranges, times in seconds and
+    # address range is inclusive and matches events overlapping it
+    # When an address range is given, the (level, address) index is more
+    # selective than the time index: "+e.time" prevents SQLite from
+    # choosing the time index to filter or sort events
+    def _where(self, trace_id=None, level=None, write=None, tgid=None,
+               task=None, time=None, address=None):
+        conditions = []
+        params = []
+        time_expr = "e.time" if address is None else "+e.time"
+        if trace_id is not None:
+            conditions.append("e.trace_id = ?")
+            params.append(trace_id)
+        if level is not None:
+            conditions.append("e.level = ?")
+            params.append(level.value)
+        if write is not None:
+            conditions.append("e.write = ?")
+            params.append(int(write))
+        if tgid is not None:
+            conditions.append("e.tgid = ?")
+            params.append(tgid)
+        if task is not None:
+            conditions.append("e.task_id = ?")
+            params.append(self._tasks.get(task, -1))
+        if time is not None:
+            conditions.append("%s BETWEEN ? AND ?" % time_expr)
+            params.extend([round(time[0] * 1e9), round(time[1] * 1e9)])
+        if address is not None:
+            levels = [level] if level is not None else list(iotracer.IoLevel)
+            span_conditions = []
+            for span_level in levels:
+                row = self._db.execute(
+                    "SELECT max_span FROM level_span WHERE level = ?",
+                    (span_level.value,)).fetchone()
+                if row is None:
+                    continue
+                span_conditions.append(
+                    "(e.level = ? AND e.address BETWEEN ? AND ?"
+                    " AND e.end_address > ?)")
+                params.extend([span_level.value, address[0] - row[0] + 1,
+                               address[1], address[0]])
+            conditions.append("(%s)" % (" OR ".join(span_conditions) or "0"))
+        return (" WHERE " + " AND ".join(conditions) if conditions else "",
+                params, time_expr)
+    
+    def _select(self, columns, order, limit, criteria):
+        (where, params, time_expr) = self._where(**criteria)
+        sql = "SELECT %s FROM event e%s ORDER BY %s %s" % (
+            columns, where, time_expr,
+            "DESC" if order == 'desc' else "ASC")
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+        return self._db.execute(sql, params)
+    
+    # Return events matching criteria (see _where) as IoEventArrays
+    # (file ids are not returned)
+    def arrays(self, order='asc', limit=None, **criteria):
+        rows = self._select(self._columns, order, limit, criteria).fetchall()
+        data = numpy.array(rows, dtype=numpy.int64).reshape(-1, 7)
+        task_ids = sorted(self._tasks.values())
+        names = {task_id: name for (name, task_id) in self._tasks.items()}
+        task_codes = numpy.zeros(max(task_ids, default=0) + 1,
+                                 dtype=numpy.int32)
+        task_codes[task_ids] = numpy.arange(len(task_ids))
+        return iotracer_arrays.IoEventArrays(
+            data[:, 0] / 1e9, data[:, 1].astype(bool), data[:, 2],
+            data[:, 3], data[:, 4].astype(numpy.int8),
+            task_codes[data[:, 5]], data[:, 6],
+            [names[task_id] for task_id in task_ids])
+    
+    # Iterate on events matching criteria (see _where) as IoEvent
+    def events(self, order='asc', limit=None, **criteria):
+        names = {task_id: name for (name, task_id) in self._tasks.items()}
+        for (time_ns, write, address, size, level, task_id, tgid,
+             file_id) in self._select(self._columns + ", e.file_id", order,
+                                      limit, criteria):
+            line = '%d.%09d;%s;%s;%s;%s;%s;%s' % (
+                time_ns // 1000000000, time_ns % 1000000000,
+                'W' if write else 'R', address, size,
+                iotracer.IoLevel(level).name, names[task_id], tgid)
+            if file_id is not None:
+                line += ';%s' % file_id
+            yield iotracer.IoEvent(line)
+
+
+def _range(range_str, value_type):
+    (first, sep, last) = range_str.partition(':')
+    return (value_type(first), value_type(last if sep else first))
+
+
+def import_logs(args):
+    store = TraceStore(args.database)
+    for logfile in args.logs:
+        start = time.monotonic()
+        (trace_id, nb_events) = store.import_log(
+            iotracer.IoTracerLog(logfile), logfile, args.time_zero)
+        elapsed = time.monotonic() - start
+        print("%s: trace %s, %s events in %.3fs (%.0f events/s)" % (
+            logfile, trace_id, nb_events, elapsed,
+            nb_events / elapsed if elapsed > 0 else 0))
+
+
+def list_traces(args):
+    store = TraceStore(args.database)
+    print("trace_id\tname\ttime_zero\tevents")
+    for row in store.traces():
+        print("%s\t%s\t%s\t%s" % row)
+
+
+def query_events(args):
+    store = TraceStore(args.database)
+    criteria = {
+        'trace_id': args.trace,
+        'level': getattr(iotracer.IoLevel, args.level) if args.level else None,
+        'write': True if args.write else (False if args.read else None),
+        'tgid': args.tgid,
+        'task': args.task,
+        'time': _range(args.time, float) if args.time else None,
+        'address': _range(args.address, int) if args.address else None,
+    }
+    start = time.monotonic()
+    events = list(store.events('desc' if args.last else 'asc', args.limit,
+                               **criteria))
+    elapsed = time.monotonic() - start
+    for event in events:
+        print(event_reorder.event_line(event), end='')
+    print("%s events in %.6fs" % (len(events), elapsed))
+
+
+if __name__ == "__main__":
+    # create the top-level parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('database', help='SQLite database file')
+    subparsers = parser.add_subparsers()
+    
+    # create the parser for the "import" command
+    parser_import = subparsers.add_parser('import',
+                                          help='load iotracer logs')
+    parser_import.add_argument('logs', nargs='+',
+                               help='files containing iotracer log')
+    parser_import.add_argument('--time-zero',
+                               help='time zero of the logs (second field'
+                                    ' of their control file)')
+    parser_import.set_defaults(func=import_logs)
+    
+    # create the parser for the "list" command
+    parser_list = subparsers.add_parser('list', help='list loaded logs')
+    parser_list.set_defaults(func=list_traces)
+    
+    # create the parser for the "query" command
+    parser_query = subparsers.add_parser('query', help='print events')
+    parser_query.add_argument('--trace', type=int, help='trace id')
+    parser_query.add_argument('--level', choices=['VFS', 'BLK'])
+    parser_query.add_argument('--write', action='store_true',
+                              help='only write events')
+    parser_query.add_argument('--read', action='store_true',
+                              help='only read events')
+    parser_query.add_argument('--tgid', type=int, help='process id')
+    parser_query.add_argument('--task', help='process name')
+    parser_query.add_argument('--time', metavar='FIRST:LAST',
+                              help='time range in seconds')
+    parser_query.add_argument('--address', metavar='FIRST:LAST',
+                              help='events overlapping address range'
+                                   ' (sectors for BLK, bytes for VFS)')
+    parser_query.add_argument('--last', action='store_true',
+                              help='most recent events first')
+    parser_query.add_argument('--limit', type=int,
+                              help='maximal number of events')
+    parser_query.set_defaults(func=query_events)
+    
+    # parse argument lists
+    args = parser.parse_args()
+    
+    if hasattr(args, 'func'):
+        # do the work
+        args.func(args)
+    else:
+        parser.print_usage()
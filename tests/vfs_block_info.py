@@ -13,12 +13,19 @@
 # more details.
 
 import argparse
+import bisect
+import fcntl
+import itertools
+import os
 import re
-import math
+import struct
 
+from collections import defaultdict
 from collections import namedtuple
+from collections import OrderedDict
 from abc import ABCMeta
 
+import numpy
 import iotracer
 
 file_extent = namedtuple('file_extent',
@@ -49,6 +56,78 @@ class FileExtentsListPrototype(metaclass=ABCMeta):
         return self._extent_tab
 
 
+"""
+    Table of extents of a file stored as numpy arrays sorted by logical
+    offset, with a second ordering by physical offset, so that looking up
+    offsets is done with a binary search
+"""
+
+
+class ExtentTable:
+    def __init__(self, extent_tab):
+        extents = sorted(extent_tab, key=lambda e: e.logical_offset)
+        self.logical_start = numpy.fromiter(
+            (e.logical_offset for e in extents), dtype=numpy.int64,
+            count=len(extents))
+        self.physical_start = numpy.fromiter(
+            (e.physical_offset for e in extents), dtype=numpy.int64,
+            count=len(extents))
+        self.length = numpy.fromiter(
+            (e.length for e in extents), dtype=numpy.int64,
+            count=len(extents))
+        self.logical_end = self.logical_start + self.length
+        self._physical_order = numpy.argsort(self.physical_start,
+                                             kind='stable')
+        self._sorted_physical_start = self.physical_start[
+            self._physical_order]
+        # python lists are faster than numpy arrays for scalar bisect
+        self._logical_start_list = self.logical_start.tolist()
+        self._physical_start_list = self._sorted_physical_start.tolist()
+        self._extents = extents
+    
+    def __len__(self):
+        return len(self._extents)
+    
+    def extent(self, index):
+        return self._extents[index]
+    
+    # Return index of extents containing logical blocks, -1 if none
+    def index_from_logical_offsets(self, offsets):
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        if len(self) == 0:
+            return numpy.full(offsets.shape, -1, dtype=numpy.intp)
+        index = numpy.searchsorted(self.logical_start, offsets,
+                                   side='right') - 1
+        found = (index >= 0) & (offsets < self.logical_end[index])
+        return numpy.where(found, index, -1)
+    
+    # Return index of extents containing physical blocks, -1 if none
+    def index_from_physical_offsets(self, offsets):
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        if len(self) == 0:
+            return numpy.full(offsets.shape, -1, dtype=numpy.intp)
+        pos = numpy.searchsorted(self._sorted_physical_start, offsets,
+                                 side='right') - 1
+        index = self._physical_order[pos]
+        found = ((pos >= 0) &
+                 (offsets < self.physical_start[index] + self.length[index]))
+        return numpy.where(found, index, -1)
+    
+    def index_from_logical_offset(self, offset):
+        index = bisect.bisect_right(self._logical_start_list, offset) - 1
+        if index >= 0 and offset < self.logical_end[index]:
+            return index
+        return -1
+    
+    def index_from_physical_offset(self, offset):
+        pos = bisect.bisect_right(self._physical_start_list, offset) - 1
+        if pos >= 0:
+            index = self._physical_order[pos]
+            if offset < self.physical_start[index] + self.length[index]:
+                return index
+        return -1
+
+
 """ 
     List of extents of a file
     That is list of contiguous blocks allocated in the file system
@@ -63,24 +142,152 @@ class FileExtentsList:
         self.nb_blocks = prototype.get_nb_blocks()
         self.block_size = prototype.get_block_size()
         self._extent_tab = prototype.get_extent_tab()
+        self.extents = ExtentTable(self._extent_tab)
     
     def extent_from_logical_offset(self, offset):
-        extent = None
-        for e in self._extent_tab:
-            if ((e.logical_offset <= offset) and
-                    (offset < e.logical_offset + e.length)):
-                extent = e
-                break
-        return extent
+        index = self.extents.index_from_logical_offset(offset)
+        return self.extents.extent(index) if index >= 0 else None
     
     def extent_from_physical_offset(self, offset):
-        extent = None
-        for e in self._extent_tab:
-            if ((e.physical_offset <= offset) and
-                    (offset < e.physical_offset + e.length)):
-                extent = e
-                break
-        return extent
+        index = self.extents.index_from_physical_offset(offset)
+        return self.extents.extent(index) if index >= 0 else None
+    
+    """
+        Convert VFS accesses (arrays of addresses and sizes in bytes) to
+        the block ranges they should produce.
+        Return three arrays: index of the VFS access, physical address
+        (in 512 bytes sectors) and size in bytes of each block range.
+        An access spanning several extents gives one range per extent.
+        Raise an exception if an access hits a block that has no extent.
+    """
+    
+    def logical_to_block_ranges(self, address, size, directio=False):
+        extents = self.extents
+        block_size = self.block_size
+        address = numpy.asarray(address, dtype=numpy.int64)
+        size = numpy.asarray(size, dtype=numpy.int64)
+        
+        accessed = numpy.flatnonzero(size > 0)
+        first_byte = address[accessed]
+        end_byte = first_byte + size[accessed]
+        first_block = first_byte // block_size
+        last_block = (end_byte - 1) // block_size
+        
+        # extents range [first_ext, last_ext] overlapping each access
+        first_ext = numpy.maximum(
+            numpy.searchsorted(extents.logical_start, first_block,
+                               side='right') - 1, 0)
+        last_ext = numpy.searchsorted(extents.logical_start, last_block,
+                                      side='right') - 1
+        nb_pieces = numpy.maximum(last_ext - first_ext + 1, 0)
+        
+        # one row per (access, extent) piece
+        piece_access = numpy.repeat(numpy.arange(len(accessed)), nb_pieces)
+        piece_start = numpy.cumsum(nb_pieces) - nb_pieces
+        piece_ext = (first_ext[piece_access] +
+                     numpy.arange(len(piece_access)) -
+                     piece_start[piece_access])
+        
+        ext_first_block = extents.logical_start[piece_ext]
+        ext_end_block = extents.logical_end[piece_ext]
+        start_block = numpy.maximum(first_block[piece_access],
+                                    ext_first_block)
+        end_block = numpy.minimum(last_block[piece_access] + 1,
+                                  ext_end_block)
+        mapped = end_block > start_block
+        
+        # check every accessed block belongs to an extent
+        covered = numpy.bincount(piece_access[mapped],
+                                 weights=(end_block - start_block)[mapped],
+                                 minlength=len(accessed))
+        unmapped = numpy.flatnonzero(covered != last_block - first_block + 1)
+        if len(unmapped) > 0:
+            raise Exception("Warning: no extent for block_index %s" % (
+                first_block[unmapped[0]]))
+        
+        piece_access = piece_access[mapped]
+        piece_ext = piece_ext[mapped]
+        ext_first_block = ext_first_block[mapped]
+        ext_end_block = ext_end_block[mapped]
+        ext_physical = extents.physical_start[piece_ext]
+        
+        if directio:
+            start_byte = numpy.maximum(first_byte[piece_access],
+                                       ext_first_block * block_size)
+            stop_byte = numpy.minimum(end_byte[piece_access],
+                                      ext_end_block * block_size)
+            physical_byte = (start_byte - ext_first_block * block_size +
+                             ext_physical * block_size)
+            range_size = stop_byte - start_byte
+        else:
+            start_block = start_block[mapped]
+            physical_byte = (start_block - ext_first_block +
+                             ext_physical) * block_size
+            range_size = (end_block[mapped] - start_block) * block_size
+        
+        return accessed[piece_access], physical_byte // 512, range_size
+
+
+"""
+    Reverse map from physical blocks to files, built from the extents of
+    many files (FileExtentsList objects using the same block size)
+    Extents of all files are merged in arrays sorted by physical offset, so
+    that each lookup is a binary search. Extents of different files are
+    supposed not to share blocks.
+"""
+
+
+class PhysicalExtentsIndex:
+    def __init__(self, file_extents_lists):
+        self.files = list(file_extents_lists)
+        block_sizes = set(f.block_size for f in self.files)
+        if len(block_sizes) > 1:
+            raise ValueError("files have different block sizes: %s" %
+                             sorted(block_sizes))
+        self.block_size = block_sizes.pop() if block_sizes else 4096
+        
+        tables = [f.extents for f in self.files]
+        file_index = numpy.repeat(numpy.arange(len(tables)),
+                                  [len(t) for t in tables])
+        physical = numpy.concatenate(
+            [t.physical_start for t in tables] + [numpy.empty(0, int)])
+        order = numpy.argsort(physical, kind='stable')
+        self.physical_start = physical[order]
+        self.physical_end = self.physical_start + numpy.concatenate(
+            [t.length for t in tables] + [numpy.empty(0, int)])[order]
+        self.logical_start = numpy.concatenate(
+            [t.logical_start for t in tables] + [numpy.empty(0, int)])[order]
+        self.file_index = file_index[order]
+    
+    def __len__(self):
+        return len(self.physical_start)
+    
+    """
+        Attribute sectors (512 bytes units, as in BLK events) to files
+        Return two arrays: index in files of the file containing each
+        sector (-1 if none) and logical offset in bytes of the sector in
+        this file (-1 if none)
+    """
+    
+    def files_from_sectors(self, sectors):
+        sectors = numpy.asarray(sectors, dtype=numpy.int64)
+        sectors_per_block = self.block_size // 512
+        blocks = sectors // sectors_per_block
+        if len(self) == 0:
+            return (numpy.full(sectors.shape, -1, dtype=numpy.int64),
+                    numpy.full(sectors.shape, -1, dtype=numpy.int64))
+        
+        index = numpy.searchsorted(self.physical_start, blocks,
+                                   side='right') - 1
+        found = (index >= 0) & (blocks < self.physical_end[index])
+        file_index = numpy.where(found, self.file_index[index], -1)
+        logical_offset = numpy.where(
+            found,
+            ((self.logical_start[index] + blocks -
+              self.physical_start[index]) * self.block_size +
+             (sectors % sectors_per_block) * 512),
+            -1)
+        return file_index, logical_offset
 
 
 """ 
@@ -152,53 +359,130 @@ r"^File size of (?P<filepath>.+?) is (?P<file_size>\d+) \((?P<nb_blocks>\d+) blo
                     self._parse_extents(filefrag_output)
 
 
+"""
+    Class allowing to create FileExtentsList corresponding to a specific file
+    by reading its mapping with the FIEMAP ioctl
+    Extents are fetched by batches of batch_size extents and cached by
+    (device, inode, modification time, size), so an unchanged file is not
+    queried again. The cache keeps the extents of the cache_size files used
+    most recently.
+    Extents whose location is unknown (not allocated yet, as delayed
+    allocations) are skipped: their blocks have no physical address.
+"""
+
+
+class FiemapExtentsReader(FileExtentsListPrototype):
+    # struct fiemap and struct fiemap_extent from linux/fiemap.h
+    _fiemap_struct = struct.Struct('=QQIIII')
+    _fiemap_extent_struct = struct.Struct('=QQQQQIIII')
+    _FS_IOC_FIEMAP = 0xC020660B
+    _FIEMAP_MAX_OFFSET = 0xFFFFFFFFFFFFFFFF
+    _FIEMAP_FLAG_SYNC = 0x00000001
+    _FIEMAP_EXTENT_LAST = 0x00000001
+    _FIEMAP_EXTENT_UNKNOWN = 0x00000002
+    _FIEMAP_EXTENT_DELALLOC = 0x00000004
+    
+    _cache = OrderedDict()
+    cache_size = 64
+    
+    def __init__(self, filename, batch_size=4096):
+        super().__init__()
+        self._filepath = filename
+        self._batch_size = batch_size
+        
+        st = os.stat(filename)
+        self._block_size = os.statvfs(filename).f_bsize
+        self._filesize = st.st_size
+        self._nb_blocks = -(-st.st_size // self._block_size)
+        
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+        else:
+            self._cache[key] = self._read_extents(filename)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._extent_tab = list(self._cache[key])
+    
+    @classmethod
+    def clear_cache(cls):
+        cls._cache.clear()
+    
+    def _read_extents(self, filename):
+        extent_tab = []
+        block_size = self._block_size
+        buf = bytearray(self._fiemap_struct.size +
+                        self._batch_size * self._fiemap_extent_struct.size)
+        start = 0
+        last = False
+        with open(filename, 'rb') as file:
+            while not last:
+                self._fiemap_struct.pack_into(buf, 0, start,
+                                              self._FIEMAP_MAX_OFFSET - start,
+                                              self._FIEMAP_FLAG_SYNC, 0,
+                                              self._batch_size, 0)
+                fcntl.ioctl(file.fileno(), self._FS_IOC_FIEMAP, buf)
+                mapped_extents = self._fiemap_struct.unpack_from(buf, 0)[3]
+                if mapped_extents == 0:
+                    break
+                
+                for fe in self._fiemap_extent_struct.iter_unpack(
+                        memoryview(buf)[self._fiemap_struct.size:
+                                        self._fiemap_struct.size +
+                                        mapped_extents *
+                                        self._fiemap_extent_struct.size]):
+                    (logical, physical, length, _, _, flags) = fe[:6]
+                    start = logical + length
+                    last = bool(flags & self._FIEMAP_EXTENT_LAST)
+                    if flags & (self._FIEMAP_EXTENT_UNKNOWN |
+                                self._FIEMAP_EXTENT_DELALLOC):
+                        continue
+                    extent_tab.append(
+                        file_extent(logical // block_size,
+                                    physical // block_size,
+                                    -(-length // block_size)))
+        return extent_tab
+
+
 """ 
     Giving FileExtentsList corresponding to a file and I/O Tracer log
     of access to this file, display for each VFS access the corresponding
     block access it should produce
+    Events are read by chunks and all VFS accesses of a chunk are converted
+    at once
 """
 
 
-def vfs_to_block(iotracer_log, file_extents, directio):
-    for event in iotrace.events():
-        print("%s:%s:%s:%s:%s:%s:%s" % (event.time,
-                                        event.type,
-                                        event.address,
-                                        event.size,
-                                        event.level.name,
-                                        event.task_name,
-                                        event.task_pid))
-        if event.level is iotracer.IoLevel.VFS:
-            address = event.address
-            size = event.size
-            while size > 0:
-                block_index = int(address / filemap.block_size)
-                offset_in_block = address - (block_index * filemap.block_size)
-                extent = filemap.extent_from_logical_offset(block_index)
-                if extent:
-                    offset_in_extent = block_index - extent.logical_offset
-                    if directio:
-                        physical_address = (int(offset_in_block / 512) +
-                                            (int(filemap.block_size / 512) *
-                                             (offset_in_extent +
-                                              extent.physical_offset)))
-                        block_access_size = event.size
-                    else:
-                        physical_address = (int(filemap.block_size / 512) *
-                                            (offset_in_extent +
-                                             extent.physical_offset))
-                        nb_blocks = math.ceil((size + offset_in_block)
-                                              / filemap.block_size)
-                        if nb_blocks > (extent.length - offset_in_extent):
-                            nb_blocks = extent.length
-                        block_access_size = nb_blocks * filemap.block_size
-                    print("->\t%s:%s:BLK" % (
-                        physical_address, block_access_size))
-                    size -= block_access_size
-                    address += block_access_size
-                else:
-                    raise Exception("Warning: no extent for block_index %s" % (
-                        block_index))
+def vfs_to_block(iotracer_log, file_extents, directio, chunk_size=65536):
+    events = iotracer_log.events()
+    chunk = list(itertools.islice(events, chunk_size))
+    while chunk:
+        vfs_index = [i for i, event in enumerate(chunk)
+                     if event.level is iotracer.IoLevel.VFS]
+        (access, physical_address,
+         block_access_size) = file_extents.logical_to_block_ranges(
+            [chunk[i].address for i in vfs_index],
+            [chunk[i].size for i in vfs_index],
+            directio)
+        
+        ranges = defaultdict(list)
+        for i, address, size in zip(access.tolist(),
+                                    physical_address.tolist(),
+                                    block_access_size.tolist()):
+            ranges[vfs_index[i]].append((address, size))
+        
+        for i, event in enumerate(chunk):
+            print("%s:%s:%s:%s:%s:%s:%s" % (event.time,
+                                            event.type,
+                                            event.address,
+                                            event.size,
+                                            event.level.name,
+                                            event.task_name,
+                                            event.task_pid))
+            for address, size in ranges.get(i, ()):
+                print("->\t%s:%s:BLK" % (address, size))
+        
+        chunk = list(itertools.islice(events, chunk_size))
 
 
 if __name__ == "__main__":
@@ -206,7 +490,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('iotracerlog', help='file containing iotracer log')
     parser.add_argument('filefrag',
-                        help='file containing output of command filefrag -v')
+                        help='file containing output of command filefrag -v'
+                             ' (monitored file itself with --fiemap)')
+    parser.add_argument('--fiemap', action='store_true',
+                        help='read extents of the file with FIEMAP ioctl')
     parser.add_argument('--directio', action='store_true',
                         help='log corresponds to direct I/O access')
     
@@ -219,9 +506,12 @@ if __name__ == "__main__":
         print('Failed to parse iotracer log', e)
     else:
         try:
-            filemap = FileExtentsList(FilefragOutputParser(args.filefrag))
+            if args.fiemap:
+                filemap = FileExtentsList(FiemapExtentsReader(args.filefrag))
+            else:
+                filemap = FileExtentsList(FilefragOutputParser(args.filefrag))
         except Exception as e:
-            print('Failed to parse filefrag output', e)
+            print('Failed to get extents of file', e)
         else:
             try:
                 vfs_to_block(iotrace, filemap, args.directio)